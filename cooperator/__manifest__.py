@@ -7,7 +7,7 @@
 {
     "name": "Cooperators",
     "summary": "Manage your cooperators",
-    "version": "12.0.6.4.3",
+    "version": "12.0.6.8.0",
     "depends": [
         "account",
         "base_iban",
@@ -31,6 +31,8 @@
         "wizard/create_subscription_from_partner.xml",
         "wizard/validate_subscription_request.xml",
         "wizard/update_share_line.xml",
+        "wizard/import_subscription_request.xml",
+        "wizard/subscription_register_holdings.xml",
         "views/subscription_request_view.xml",
         "views/mail_template_view.xml",
         "views/res_partner_view.xml",
@@ -40,6 +42,8 @@
         "views/product_view.xml",
         "views/res_company_view.xml",
         "views/account_journal_view.xml",
+        "report/capital_report_view.xml",
+        "views/export_actions.xml",
         "views/menus.xml",
         "report/reports.xml",
         "report/layout.xml",
@@ -48,6 +52,7 @@
         "report/cooperator_subscription_G001.xml",
         "report/cooperator_register_G001.xml",
         "data/mail_template_data.xml",  # Must be loaded after reports
+        "data/scheduler_data.xml",
     ],
     "demo": [
         "demo/coop.xml",
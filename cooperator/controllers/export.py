@@ -0,0 +1,145 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import csv
+import datetime
+import io
+import logging
+import tempfile
+import uuid
+
+from werkzeug.exceptions import Forbidden, NotFound
+from werkzeug.wrappers import Response
+
+from odoo import api, http
+from odoo.http import request
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import xlsxwriter
+except ImportError:
+    _logger.debug("Cannot import xlsxwriter")
+    xlsxwriter = None
+
+# exported model and method returning the header, the query and its
+# parameters, by export name.
+EXPORTS = {
+    "register": ("subscription.register", "_get_export_query"),
+    "members": ("res.partner", "_get_member_export_query"),
+}
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+# size of the chunks of data sent to the client
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_query_rows(cr, query, params, itersize=2000):
+    """
+    Yield the rows of query, fetched by batches of itersize rows through a
+    server-side cursor, so that the rows are never all loaded in memory.
+    """
+    # the named cursor is opened on the connection of cr, so that it sees
+    # the same transaction.
+    server_cursor = cr._cnx.cursor(name="cooperator_export_%s" % uuid.uuid4().hex)
+    server_cursor.itersize = itersize
+    try:
+        server_cursor.execute(query, params)
+        yield from server_cursor
+    finally:
+        server_cursor.close()
+
+
+def iter_csv(header, rows):
+    """Yield the csv file of header and rows by chunks of bytes."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_xlsx(header, rows):
+    """
+    Yield the xlsx file of header and rows by chunks of bytes. The file is
+    written row by row to a temporary file, as the xlsx format cannot be
+    streamed while it is written.
+    """
+    with tempfile.TemporaryFile() as xlsx_file:
+        # in constant memory mode, each row is flushed to disk when the
+        # next one is written.
+        workbook = xlsxwriter.Workbook(
+            xlsx_file, {"constant_memory": True, "in_memory": False}
+        )
+        worksheet = workbook.add_worksheet()
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+        worksheet.write_row(0, 0, header)
+        for row_index, row in enumerate(rows, start=1):
+            for col_index, value in enumerate(row):
+                if isinstance(value, datetime.date):
+                    worksheet.write_datetime(
+                        row_index, col_index, value, date_format
+                    )
+                elif value is not None:
+                    worksheet.write(row_index, col_index, value)
+        workbook.close()
+        xlsx_file.seek(0)
+        chunk = xlsx_file.read(CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = xlsx_file.read(CHUNK_SIZE)
+
+
+class CooperatorExport(http.Controller):
+    @http.route(
+        "/cooperator/export/<string:name>.<string:file_format>",
+        type="http",
+        auth="user",
+    )
+    def export(self, name, file_format, **kw):
+        """
+        Stream the export name (register or members) as a csv or xlsx
+        file.
+        """
+        if name not in EXPORTS or file_format not in CONTENT_TYPES:
+            raise NotFound()
+        if file_format == "xlsx" and xlsxwriter is None:
+            raise NotFound()
+        if not request.env.user.has_group("cooperator.cooperator_group_user"):
+            raise Forbidden()
+
+        registry = request.env.registry
+        uid = request.env.uid
+        context = dict(request.env.context)
+        model_name, method_name = EXPORTS[name]
+        formatter = iter_xlsx if file_format == "xlsx" else iter_csv
+
+        def generate():
+            # the request cursor is closed when the response is sent, so
+            # the export uses its own cursor.
+            with api.Environment.manage(), registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                header, query, params = getattr(env[model_name], method_name)()
+                rows = iter_query_rows(cr, query, params)
+                yield from formatter(header, rows)
+
+        filename = "%s_%s.%s" % (
+            name,
+            datetime.date.today().isoformat(),
+            file_format,
+        )
+        return Response(
+            generate(),
+            headers=[
+                ("Content-Type", CONTENT_TYPES[file_format]),
+                ("Content-Disposition", 'attachment; filename="%s"' % filename),
+            ],
+            direct_passthrough=True,
+        )
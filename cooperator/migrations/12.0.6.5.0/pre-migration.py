@@ -0,0 +1,28 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+
+def migrate(cr, version):
+    # fill the normalized identity columns of res_partner in sql, so that
+    # they don't have to be computed through the orm for every partner when
+    # the module is updated. this must stay consistent with
+    # normalize_email() and normalize_identifier() in models/partner.py.
+    cr.execute(
+        """
+        alter table res_partner
+            add column if not exists email_key varchar,
+            add column if not exists company_register_number_key varchar,
+            add column if not exists vat_key varchar
+        """
+    )
+    cr.execute(
+        """
+        update res_partner
+        set email_key = nullif(lower(btrim(email, E' \\t\\r\\n')), ''),
+            company_register_number_key = nullif(
+                regexp_replace(lower(company_register_number), '[^0-9a-z]+', '', 'g'),
+                ''
+            ),
+            vat_key = nullif(regexp_replace(lower(vat), '[^0-9a-z]+', '', 'g'), '')
+        """
+    )
@@ -0,0 +1,38 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+
+def migrate(cr, version):
+    # number_of_share and total_value are now stored. create and fill the
+    # columns in sql, so that they don't have to be computed through the orm
+    # for every partner when the module is updated.
+    cr.execute(
+        """
+        alter table res_partner
+            add column if not exists number_of_share integer,
+            add column if not exists total_value double precision
+        """
+    )
+    cr.execute(
+        """
+        update res_partner
+        set number_of_share = 0,
+            total_value = 0
+        """
+    )
+    cr.execute(
+        """
+        with share_totals as (
+            select partner_id,
+                sum(share_number) as number_of_share,
+                sum(share_number * coalesce(share_unit_price, 0)) as total_value
+            from share_line
+            group by partner_id
+        )
+        update res_partner
+        set number_of_share = share_totals.number_of_share,
+            total_value = share_totals.total_value
+        from share_totals
+        where res_partner.id = share_totals.partner_id
+        """
+    )
@@ -0,0 +1,21 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+
+def migrate(cr, version):
+    # total_amount_line of subscription.register is now stored. create and
+    # fill the column in sql, so that it doesn't have to be computed through
+    # the orm for every register line when the module is updated.
+    cr.execute(
+        """
+        alter table subscription_register
+            add column if not exists total_amount_line numeric
+        """
+    )
+    cr.execute(
+        """
+        update subscription_register
+        set total_amount_line = coalesce(share_unit_price, 0)
+            * coalesce(quantity, 0)
+        """
+    )
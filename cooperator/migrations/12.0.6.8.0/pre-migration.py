@@ -0,0 +1,21 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+
+def migrate(cr, version):
+    # total_amount_line of share.line is now stored. create and fill the
+    # column in sql, so that it doesn't have to be computed through the orm
+    # for every share line when the module is updated.
+    cr.execute(
+        """
+        alter table share_line
+            add column if not exists total_amount_line numeric
+        """
+    )
+    cr.execute(
+        """
+        update share_line
+        set total_amount_line = coalesce(share_unit_price, 0)
+            * coalesce(share_number, 0)
+        """
+    )
@@ -8,3 +8,6 @@ from . import account_invoice
 from . import company
 from . import account_journal
 from . import mail_template
+from . import mail_outbox
+from . import ir_sequence
+from . import ir_actions_report
@@ -3,9 +3,16 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 
+import logging
+from ast import literal_eval
 from datetime import datetime
 
-from odoo import api, fields, models
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+from ..tools import commit_unless_testing
+
+_logger = logging.getLogger(__name__)
 
 
 class AccountInvoice(models.Model):
@@ -15,6 +22,20 @@ class AccountInvoice(models.Model):
         "subscription.request", string="Subscription request"
     )
     release_capital_request = fields.Boolean(string="Release of capital request")
+    capital_release_mail_state = fields.Selection(
+        [
+            ("pending", "Pending"),
+            ("rendered", "Rendered"),
+            ("sent", "Sent"),
+            ("failed", "Failed"),
+        ],
+        string="Capital release email state",
+        help="State of the capital release request email when it is sent"
+        " by the scheduled action.",
+        readonly=True,
+        copy=False,
+        index=True,
+    )
 
     @api.model
     def _prepare_refund(
@@ -33,20 +54,64 @@ class AccountInvoice(models.Model):
         return values
 
     def create_user(self, partner):
-        user_obj = self.env["res.users"]
-        email = partner.email
-
-        user = user_obj.search([("login", "=", email)])
-        if not user:
-            user = user_obj.search([("login", "=", email), ("active", "=", False)])
-            if user:
-                user.sudo().write({"active": True})
-            else:
-                user_values = {"partner_id": partner.id, "login": email}
-                user = user_obj.sudo()._signup_create_user(user_values)
-                user.sudo().with_context({"create_user": True}).action_reset_password()
-
-        return user
+        return self.create_users(partner)
+
+    def _get_signup_mail_template(self):
+        return self.env.ref(
+            "auth_signup.set_password_email", raise_if_not_found=False
+        ) or self.env.ref("auth_signup.reset_password_email")
+
+    def create_users(self, partners):
+        """
+        Return the users of partners, whose login is their email. Archived
+        users are reactivated and missing users are created from the portal
+        user template, at once. The mails inviting the new users to set
+        their password are queued in the mail outbox.
+        """
+        user_obj = self.env["res.users"].sudo().with_context(active_test=False)
+        partners_by_email = {}
+        for partner in partners:
+            if partner.email:
+                partners_by_email.setdefault(partner.email, partner)
+        if not partners_by_email:
+            return user_obj.browse()
+
+        users = user_obj.search([("login", "in", list(partners_by_email))])
+        users.filtered(lambda user: not user.active).write({"active": True})
+
+        existing_logins = set(users.mapped("login"))
+        missing = [
+            (email, partner)
+            for email, partner in partners_by_email.items()
+            if email not in existing_logins
+        ]
+        if missing:
+            template_user_id = literal_eval(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param("base.template_portal_user_id", "False")
+            )
+            template_user = user_obj.browse(template_user_id).exists()
+            if not template_user:
+                raise UserError(_("Signup: invalid template user"))
+            vals_list = [
+                template_user.copy_data(
+                    {"partner_id": partner.id, "login": email, "active": True}
+                )[0]
+                for email, partner in missing
+            ]
+            new_users = user_obj.with_context(no_reset_password=True).create(
+                vals_list
+            )
+            new_users.mapped("partner_id").signup_prepare(
+                signup_type="reset", expiration=False
+            )
+            self.env["cooperator.mail.outbox"].enqueue(
+                self._get_signup_mail_template(), new_users
+            )
+            users |= new_users
+
+        return users.with_env(self.env)
 
     def get_mail_template_certificate(self):
         if self.partner_id.member:
@@ -80,13 +145,38 @@ class AccountInvoice(models.Model):
             "type": "subscription",
         }
 
-    def get_membership_vals(self):
+    @api.multi
+    def _allocate_register_numbers(self):
+        """
+        Reserve at once the cooperator numbers of the partners of self that
+        will become members, and an operation number for each invoice.
+
+        Return a tuple of two dicts: cooperator numbers by partner id and
+        operation numbers by invoice id.
+        """
+        new_members = self.mapped("partner_id").filtered(
+            lambda partner: not partner.member and not partner.old_member
+        )
+        cooperator_numbers = self.get_sequence_register().next_by_id_batch(
+            len(new_members)
+        )
+        operation_numbers = self.get_sequence_operation().next_by_id_batch(len(self))
+        return (
+            dict(zip(new_members.ids, cooperator_numbers)),
+            dict(zip(self.ids, operation_numbers)),
+        )
+
+    def get_membership_vals(self, cooperator_number=None):
         # flag the partner as an effective member
-        # if not yet cooperator we generate a cooperator number
+        # if not yet cooperator we generate a cooperator number, unless it
+        # has been allocated beforehand.
         vals = {}
         if self.partner_id.member is False and self.partner_id.old_member is False:
-            sequence_id = self.get_sequence_register()
-            sub_reg_num = sequence_id.next_by_id()
+            if cooperator_number:
+                sub_reg_num = cooperator_number
+            else:
+                sequence_id = self.get_sequence_register()
+                sub_reg_num = sequence_id.next_by_id()
             vals = {
                 "member": True,
                 "old_member": False,
@@ -97,42 +187,75 @@ class AccountInvoice(models.Model):
 
         return vals
 
-    def set_membership(self):
-        vals = self.get_membership_vals()
+    def set_membership(self, cooperator_number=None):
+        vals = self.get_membership_vals(cooperator_number=cooperator_number)
         self.partner_id.write(vals)
 
         return True
 
     def _send_certificate_mail(self, certificate_email_template, sub_reg_line):
         if self.company_id.send_certificate_email:
+            if self.env.context.get("cooperator_queue_mails"):
+                self.env["cooperator.mail.outbox"].enqueue(
+                    certificate_email_template, self.partner_id
+                )
+                return
             # we send the email with the certificate in attachment
             certificate_email_template.sudo().send_mail(self.partner_id.id, False)
 
-    def set_cooperator_effective(self, effective_date):
-        sub_register_obj = self.env["subscription.register"]
-        share_line_obj = self.env["share.line"]
-
-        certificate_email_template = self.get_mail_template_certificate()
-
-        self.set_membership()
-
-        sequence_operation = self.get_sequence_operation()
-        sub_reg_operation = sequence_operation.next_by_id()
-
+    def _get_cooperator_effective_vals(
+        self, effective_date, operation_number, certificate_email_template
+    ):
+        """
+        Return the values of the register lines and of the share lines of
+        the invoice, and the certificate mail template, which can be
+        replaced by the one of a share product.
+        """
+        sub_reg_vals_list = []
+        share_line_vals_list = []
         for line in self.invoice_line_ids:
             sub_reg_vals = self.get_subscription_register_vals(line, effective_date)
-            sub_reg_vals["name"] = sub_reg_operation
-            sub_reg_vals["register_number_operation"] = int(sub_reg_operation)
+            sub_reg_vals["name"] = operation_number
+            sub_reg_vals["register_number_operation"] = int(operation_number)
+            sub_reg_vals_list.append(sub_reg_vals)
+            share_line_vals_list.append(self.get_share_line_vals(line, effective_date))
+            if line.product_id.mail_template:
+                certificate_email_template = line.product_id.mail_template
+        return sub_reg_vals_list, share_line_vals_list, certificate_email_template
 
-            sub_reg_line = sub_register_obj.create(sub_reg_vals)
+    def set_cooperator_effective(
+        self, effective_date, cooperator_number=None, operation_number=None
+    ):
+        """
+        Make the partner an effective cooperator for the shares of the
+        invoice. cooperator_number and operation_number can be given when
+        they have been allocated beforehand (see
+        _allocate_register_numbers()), otherwise they are taken from the
+        sequences.
+        """
+        self.partner_id._lock_shares()
 
-            share_line_vals = self.get_share_line_vals(line, effective_date)
-            share_line_obj.create(share_line_vals)
+        certificate_email_template = self.get_mail_template_certificate()
 
-            if line.product_id.mail_template:
-                certificate_email_template = line.product_id.mail_template
+        self.set_membership(cooperator_number=cooperator_number)
+
+        if operation_number:
+            sub_reg_operation = operation_number
+        else:
+            sequence_operation = self.get_sequence_operation()
+            sub_reg_operation = sequence_operation.next_by_id()
+
+        (
+            sub_reg_vals_list,
+            share_line_vals_list,
+            certificate_email_template,
+        ) = self._get_cooperator_effective_vals(
+            effective_date, sub_reg_operation, certificate_email_template
+        )
+        sub_reg_lines = self.env["subscription.register"].create(sub_reg_vals_list)
+        self.env["share.line"].create(share_line_vals_list)
 
-        self._send_certificate_mail(certificate_email_template, sub_reg_line)
+        self._send_certificate_mail(certificate_email_template, sub_reg_lines[-1:])
 
         if self.company_id.create_user:
             self.create_user(self.partner_id)
@@ -144,55 +267,220 @@ class AccountInvoice(models.Model):
 
         return True
 
+    @api.multi
+    def _set_cooperators_effective(self):
+        """
+        Batch version of set_cooperator_effective() for the invoices of
+        self.
+
+        The cooperator and operation numbers are allocated at once, the
+        values of the register and share lines are built for all invoices by
+        _get_cooperator_effective_vals() and created with one create() per
+        model. The certificate mails are queued in the mail outbox by
+        _send_certificate_mail(), and the users of the partners are created
+        with one create_users() call.
+        """
+        self.mapped("partner_id")._lock_shares()
+        cooperator_numbers, operation_numbers = self._allocate_register_numbers()
+        sub_reg_vals_list = []
+        share_line_vals_list = []
+        certificates = []
+        for invoice in self:
+            start = len(sub_reg_vals_list)
+            # the template depends on the membership before the payment.
+            certificate_email_template = invoice.get_mail_template_certificate()
+            invoice.set_membership(
+                cooperator_number=cooperator_numbers.get(invoice.partner_id.id)
+            )
+            (
+                invoice_sub_reg_vals_list,
+                invoice_share_line_vals_list,
+                certificate_email_template,
+            ) = invoice._get_cooperator_effective_vals(
+                invoice._get_effective_date(),
+                operation_numbers[invoice.id],
+                certificate_email_template,
+            )
+            sub_reg_vals_list += invoice_sub_reg_vals_list
+            share_line_vals_list += invoice_share_line_vals_list
+            certificates.append(
+                (invoice, certificate_email_template, start, len(sub_reg_vals_list))
+            )
+
+        sub_reg_lines = self.env["subscription.register"].create(sub_reg_vals_list)
+        self.env["share.line"].create(share_line_vals_list)
+
+        for invoice, certificate_email_template, start, end in certificates:
+            # the last register line of the invoice, as in
+            # set_cooperator_effective().
+            invoice.with_context(cooperator_queue_mails=True)._send_certificate_mail(
+                certificate_email_template, sub_reg_lines[start:end][-1:]
+            )
+
+        # the existing users are looked up and the missing ones created for
+        # all the partners at once.
+        self.create_users(
+            self.filtered(lambda record: record.company_id.create_user).mapped(
+                "partner_id"
+            )
+        )
+
+        return True
+
     def get_refund_domain(self, invoice):
         return [
             ("type", "=", "out_refund"),
             ("origin", "=", invoice.move_name),
         ]
 
+    @api.multi
+    def _get_refunded_invoices(self):
+        """
+        Return the invoices of self that have a refund, according to
+        get_refund_domain().
+
+        When get_refund_domain() returns the default domain for every
+        invoice, the refunds are searched with one query and matched with
+        the invoices by their origin. Otherwise, each invoice is checked with
+        its own domain.
+        """
+        domains = {invoice.id: self.get_refund_domain(invoice) for invoice in self}
+        if any(
+            domains[invoice.id]
+            != [("type", "=", "out_refund"), ("origin", "=", invoice.move_name)]
+            for invoice in self
+        ):
+            return self.filtered(
+                lambda invoice: self.search_count(domains[invoice.id])
+            )
+        move_names = [name for name in self.mapped("move_name") if name]
+        if not move_names:
+            return self.browse()
+        refunds = self.search(
+            [("type", "=", "out_refund"), ("origin", "in", move_names)]
+        )
+        refunded_names = set(refunds.mapped("origin"))
+        return self.filtered(lambda invoice: invoice.move_name in refunded_names)
+
+    def _get_effective_date(self):
+        # take the effective date from the payment.
+        # by default the confirmation date is the payment date
+        effective_date = datetime.now()
+
+        if self.payment_move_line_ids:
+            move_line = self.payment_move_line_ids[0]
+            effective_date = move_line.date
+        return effective_date
+
     @api.multi
     def action_invoice_paid(self):
         super().action_invoice_paid()
-        for invoice in self:
-            # we check if there is an open refund for this invoice. in this
-            # case we don't run the process_subscription function as the
-            # invoice has been reconciled with a refund and not a payment.
-            domain = self.get_refund_domain(invoice)
-            refund = self.search(domain)
-
-            if (
-                invoice.partner_id.cooperator
-                and invoice.release_capital_request
-                and invoice.type == "out_invoice"
-                and not refund
-            ):
-                # take the effective date from the payment.
-                # by default the confirmation date is the payment date
-                effective_date = datetime.now()
-
-                if invoice.payment_move_line_ids:
-                    move_line = invoice.payment_move_line_ids[0]
-                    effective_date = move_line.date
-
-                invoice.subscription_request.state = "paid"
-                invoice.post_process_confirm_paid(effective_date)
-            # if there is a open refund we mark the subscription as cancelled
-            elif (
-                invoice.partner_id.cooperator
-                and invoice.release_capital_request
-                and invoice.type == "out_invoice"
-                and refund
-            ):
-                invoice.subscription_request.state = "cancelled"
+        capital_release_requests = self.filtered(
+            lambda invoice: invoice.partner_id.cooperator
+            and invoice.release_capital_request
+            and invoice.type == "out_invoice"
+        )
+        capital_release_requests._process_paid_capital_release_requests()
+        return True
+
+    @api.multi
+    def _process_paid_capital_release_requests(self):
+        """
+        Process the paid capital release requests of self, e.g. all the
+        invoices paid by the reconciliation of a bank statement.
+
+        A single paid invoice goes through post_process_confirm_paid().
+        Several paid invoices are made effective at once by
+        _set_cooperators_effective(), which uses the same hooks to build the
+        values of the register and share lines, but creates them with one
+        create() per model.
+        """
+        if not self:
+            return True
+        # we check if there is an open refund for the invoices. in this
+        # case we don't run the process_subscription function as the
+        # invoice has been reconciled with a refund and not a payment.
+        refunded = self._get_refunded_invoices()
+        # if there is a open refund we mark the subscription as cancelled
+        refunded.mapped("subscription_request").write({"state": "cancelled"})
+        paid = self - refunded
+        if not paid:
+            return True
+        paid.mapped("subscription_request").write({"state": "paid"})
+        if len(paid) == 1:
+            paid.post_process_confirm_paid(paid._get_effective_date())
+        else:
+            paid._set_cooperators_effective()
         return True
 
     def _get_capital_release_mail_template(self):
         return self.env.ref("cooperator.email_template_release_capital", False)
 
+    def _send_capital_release_request_mail(self):
+        email_template = self._get_capital_release_mail_template()
+        # we send the email with the capital release request in attachment
+        # TODO remove sudo() and give necessary access right
+        email_template.sudo().send_mail(self.id, True)
+        self.sent = True
+
     def send_capital_release_request_mail(self):
         if self.company_id.send_capital_release_email:
-            email_template = self._get_capital_release_mail_template()
-            # we send the email with the capital release request in attachment
-            # TODO remove sudo() and give necessary access right
-            email_template.sudo().send_mail(self.id, True)
-            self.sent = True
+            if self.company_id.capital_release_email_mode == "deferred":
+                self.capital_release_mail_state = "pending"
+            else:
+                self._send_capital_release_request_mail()
+
+    @api.model
+    def process_capital_release_requests(self, limit=50):
+        """
+        Render and send the pending capital release requests.
+
+        The pdf of each pending invoice is rendered and stored as the
+        attachment of the report, then the rendered invoices are sent (the
+        mail reuses the stored attachment). The state of each invoice is
+        committed after each step so that an interrupted run resumes where
+        it stopped. An invoice whose pdf or mail fails is marked as failed,
+        so that it does not block the others, and can be retried with
+        action_retry_capital_release_mail().
+        """
+        report = self.env.ref("cooperator.action_cooperator_invoices")
+        invoices = self.search(
+            [("capital_release_mail_state", "=", "pending")], limit=limit
+        )
+        for invoice in invoices:
+            try:
+                with self.env.cr.savepoint():
+                    report.sudo().render_qweb_pdf(invoice.ids)
+                    invoice.capital_release_mail_state = "rendered"
+            except Exception:
+                _logger.exception(
+                    "could not render capital release request %s", invoice.number
+                )
+                self.invalidate_cache()
+                invoice.capital_release_mail_state = "failed"
+            commit_unless_testing(self.env.cr)
+
+        invoices = self.search(
+            [("capital_release_mail_state", "=", "rendered")], limit=limit
+        )
+        for invoice in invoices:
+            try:
+                with self.env.cr.savepoint():
+                    invoice._send_capital_release_request_mail()
+                    invoice.capital_release_mail_state = "sent"
+            except Exception:
+                _logger.exception(
+                    "could not send capital release request %s", invoice.number
+                )
+                self.invalidate_cache()
+                invoice.capital_release_mail_state = "failed"
+            commit_unless_testing(self.env.cr)
+        return True
+
+    @api.multi
+    def action_retry_capital_release_mail(self):
+        """Queue the failed capital release requests of self again."""
+        self.filtered(
+            lambda invoice: invoice.capital_release_mail_state == "failed"
+        ).write({"capital_release_mail_state": "pending"})
+        return True
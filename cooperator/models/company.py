@@ -51,6 +51,14 @@ class ResCompany(models.Model):
         " authorised to have only one type"
         " of share",
     )
+    share_consumption_order = fields.Selection(
+        [("fifo", "First in, first out"), ("lifo", "Last in, first out")],
+        string="Share consumption order",
+        default="lifo",
+        required=True,
+        help="Order in which the share lines of a cooperator are consumed"
+        " when shares are sold back, transferred or converted.",
+    )
     display_logo1 = fields.Boolean(string="Display logo 1")
     display_logo2 = fields.Boolean(string="Display logo 2")
     bottom_logo1 = fields.Binary(string="Bottom logo 1")
@@ -106,9 +114,29 @@ class ResCompany(models.Model):
     send_confirmation_email = fields.Boolean(
         string="Send confirmation email", default=True
     )
+    confirmation_email_mode = fields.Selection(
+        [("inline", "Inline"), ("deferred", "Deferred")],
+        string="Confirmation email sending",
+        required=True,
+        default="inline",
+        help="Inline: the confirmation email is rendered when the"
+        " subscription request is created. Deferred: it is queued and"
+        " rendered later by a scheduled action, which makes the creation of"
+        " subscription requests (e.g. from the website) faster.",
+    )
     send_capital_release_email = fields.Boolean(
         string="Send Capital Release email", default=True
     )
+    capital_release_email_mode = fields.Selection(
+        [("inline", "Inline"), ("deferred", "Deferred")],
+        string="Capital release email sending",
+        required=True,
+        default="inline",
+        help="Inline: the capital release request is rendered and sent when"
+        " the subscription request is validated. Deferred: it is rendered"
+        " and sent later by a scheduled action, which makes the validation"
+        " of subscription requests faster.",
+    )
     send_waiting_list_email = fields.Boolean(
         string="Send Waiting List email", default=True
     )
@@ -0,0 +1,20 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, models
+
+
+class IrActionsReport(models.Model):
+    _inherit = "ir.actions.report"
+
+    @api.multi
+    def postprocess_pdf_report(self, record, buffer):
+        # the certificate attachment name changes with the certificate
+        # fingerprint: remove the outdated certificates of the partner
+        # before the new one is stored.
+        certificate_report = self.env.ref(
+            "cooperator.action_cooperator_report_certificat", False
+        )
+        if certificate_report and self == certificate_report:
+            record._invalidate_certificate_cache()
+        return super().postprocess_pdf_report(record, buffer)
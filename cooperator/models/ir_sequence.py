@@ -0,0 +1,47 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, models
+
+
+class IrSequence(models.Model):
+    _inherit = "ir.sequence"
+
+    @api.multi
+    def next_by_id_batch(self, count):
+        """
+        Return a list of the count next values of the sequence, reserved at
+        once.
+
+        For no-gap sequences, the sequence row is locked only once for the
+        whole range, and the numbers stay gapless since the reservation is
+        rolled back with the transaction. Sequences using date ranges fall
+        back to next_by_id().
+        """
+        self.ensure_one()
+        if count <= 0:
+            return []
+        if self.use_date_range:
+            return [self.next_by_id() for _i in range(count)]
+        self.check_access_rights("read")
+        if self.implementation == "standard":
+            self.env.cr.execute(
+                "SELECT nextval(%s) FROM generate_series(1, %s)",
+                ("ir_sequence_%03d" % self.id, count),
+            )
+            numbers = [row[0] for row in self.env.cr.fetchall()]
+        else:
+            self.env.cr.execute(
+                "SELECT number_next FROM ir_sequence WHERE id=%s FOR UPDATE NOWAIT",
+                (self.id,),
+            )
+            number_next = self.env.cr.fetchone()[0]
+            self.env.cr.execute(
+                "UPDATE ir_sequence SET number_next=number_next+%s WHERE id=%s",
+                (self.number_increment * count, self.id),
+            )
+            self.invalidate_cache(["number_next"], self.ids)
+            numbers = [
+                number_next + index * self.number_increment for index in range(count)
+            ]
+        return [self.get_next_char(number) for number in numbers]
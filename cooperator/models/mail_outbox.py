@@ -0,0 +1,100 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class CooperatorMailOutbox(models.Model):
+    """
+    Mails waiting to be rendered and sent by a scheduled action.
+
+    Enqueuing a mail only creates a row, which is much cheaper than
+    rendering the mail template. The rows are processed by
+    send_queued_mails(). A row whose mail cannot be sent is kept and marked
+    as failed, with the error, so that it does not block the other rows.
+    """
+
+    _name = "cooperator.mail.outbox"
+    _description = "Cooperator mail outbox"
+    _order = "id"
+
+    template_id = fields.Many2one(
+        "mail.template",
+        string="Mail template",
+        required=True,
+        ondelete="cascade",
+    )
+    res_model = fields.Char(string="Model", required=True)
+    res_id = fields.Integer(string="Record", required=True)
+    lang = fields.Char(string="Language")
+    failed = fields.Boolean(string="Failed", readonly=True)
+    error = fields.Text(string="Error", readonly=True)
+
+    @api.model
+    def enqueue(self, mail_template, records, lang_field="lang"):
+        """
+        Queue mail_template to be sent for each record of records.
+
+        lang_field is the field of the records holding the language used to
+        group the mails when they are sent.
+        """
+        return self.sudo().create(
+            [
+                {
+                    "template_id": mail_template.id,
+                    "res_model": records._name,
+                    "res_id": record.id,
+                    "lang": record[lang_field] if lang_field in record else False,
+                }
+                for record in records
+            ]
+        )
+
+    @api.model
+    def send_queued_mails(self, limit=500):
+        """
+        Render and send up to limit queued mails. The rows are processed by
+        template and language, so that the language context is set once per
+        group, but each mail is still rendered by its own send_mail() call.
+
+        Each mail is sent in a savepoint: the rows of the mails that are sent
+        are removed from the outbox, while the rows of the mails that fail
+        are marked as failed and skipped by the next runs.
+        """
+        rows = self.sudo().search([("failed", "=", False)], limit=limit)
+        groups = {}
+        for row in rows:
+            groups.setdefault((row.template_id, row.lang), self.sudo())
+            groups[(row.template_id, row.lang)] |= row
+        for (template, lang), group in groups.items():
+            template = template.sudo().with_context(lang=lang)
+            existing_ids = set(
+                self.env[group[0].res_model].browse(group.mapped("res_id")).exists().ids
+            )
+            failed = self.sudo()
+            for row in group:
+                if row.res_id not in existing_ids:
+                    continue
+                try:
+                    with self.env.cr.savepoint():
+                        template.send_mail(row.res_id)
+                except Exception as error:
+                    _logger.exception(
+                        "could not send queued mail %s with template %s",
+                        row.id,
+                        template.name,
+                    )
+                    self.invalidate_cache()
+                    row.write({"failed": True, "error": str(error)})
+                    failed |= row
+            (group - failed).unlink()
+            _logger.info(
+                "sent %d queued mails with template %s",
+                len(group - failed),
+                template.name,
+            )
+        return True
@@ -3,10 +3,16 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 
-from datetime import datetime
+import logging
+from collections import defaultdict
+from datetime import date, datetime
 
 from odoo import _, api, fields, models
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
+
+from ..tools import commit_unless_testing
+
+_logger = logging.getLogger(__name__)
 
 
 class OperationRequest(models.Model):
@@ -120,10 +126,16 @@ class OperationRequest(models.Model):
     invoice = fields.Many2one("account.invoice", string="Invoice")
 
     @api.multi
-    @api.constrains("effective_date")
+    @api.constrains("effective_date", "state")
     def _constrain_effective_date(self):
+        # operations can be scheduled: they are executed on their effective
+        # date by a scheduled action.
         for obj in self:
-            if obj.effective_date and obj.effective_date > fields.Date.today():
+            if (
+                obj.state == "done"
+                and obj.effective_date
+                and obj.effective_date > fields.Date.today()
+            ):
                 raise ValidationError(_("The effective date can not be in the future."))
 
     @api.multi
@@ -153,19 +165,55 @@ class OperationRequest(models.Model):
             rec.write({"state": "draft"})
 
     def get_total_share_dic(self, partner):
-        total_share_dic = {}
-        share_products = self.env["product.product"].search([("is_share", "=", True)])
-
-        for share_product in share_products:
-            total_share_dic[share_product.id] = 0
-
-        for line in partner.share_ids:
-            total_share_dic[line.share_product_id.id] += line.share_number
+        """
+        Return the number of shares of partner by share type id. Share types
+        the partner doesn't own map to 0.
+        """
+        totals = self.env["share.line"].get_share_totals(partner)
+        return defaultdict(int, totals[partner.id])
+
+    def _get_share_lots(self, partner, share_product):
+        """
+        Return the share lines (lots) of share_product of partner, in the
+        order in which they are consumed, according to the share
+        consumption order of the company.
+        """
+        lots = partner.share_ids.filtered(
+            lambda line: line.share_product_id == share_product
+        ).sorted(
+            lambda line: (line.effective_date or date.min, line.id),
+            reverse=self.company_id.share_consumption_order == "lifo",
+        )
+        return lots
+
+    def _plan_share_consumption(self, partner, share_product, quantity):
+        """
+        Compute how quantity shares of share_product are removed from the
+        share lines of partner, without modifying them. Return a tuple
+        (lines to remove, line to reduce, number of shares left on the
+        line to reduce).
+        """
+        to_remove = self.env["share.line"]
+        for lot in self._get_share_lots(partner, share_product):
+            if quantity <= 0:
+                break
+            if lot.share_number <= quantity:
+                to_remove |= lot
+                quantity -= lot.share_number
+            else:
+                return to_remove, lot, lot.share_number - quantity
+        if quantity > 0:
+            raise ValidationError(
+                _("The cooperator can't hand over more" " shares that he/she owns.")
+            )
+        return to_remove, self.env["share.line"], 0
 
-        return total_share_dic
+    def _apply_share_consumption(self, plan):
+        to_remove, to_reduce, share_left = plan
+        to_remove.unlink()
+        if to_reduce:
+            to_reduce.write({"share_number": share_left})
 
-    # This function doesn't handle the case of a cooperator can own
-    # different kinds of share type
     def hand_share_over(self, partner, share_product_id, quantity):
         if not partner.member:
             raise ValidationError(
@@ -175,35 +223,49 @@ class OperationRequest(models.Model):
                 )
             )
 
-        share_ind = len(partner.share_ids)
-        i = 1
-        while quantity > 0:
-            line = self.partner_id.share_ids[share_ind - i]
-            if line.share_product_id.id == share_product_id.id:
-                if quantity > line.share_number:
-                    quantity -= line.share_number
-                    line.unlink()
-                else:
-                    share_left = line.share_number - quantity
-                    quantity = 0
-                    line.write({"share_number": share_left})
-            i += 1
+        partner._lock_shares()
+        plan = self._plan_share_consumption(partner, share_product_id, quantity)
+        self._apply_share_consumption(plan)
         # if the cooperator sold all his shares he's no more
         # an effective member
-        remaning_share_dict = 0
-        for share_quant in self.get_total_share_dic(partner).values():
-            remaning_share_dict += share_quant
-        if remaning_share_dict == 0:
-            self.partner_id.write({"member": False, "old_member": True})
-
-    def has_share_type(self):
-        for line in self.partner_id.share_ids:
-            if line.share_product_id.id == self.share_product_id.id:
-                return True
-        return False
+        if not sum(self.get_total_share_dic(partner).values()):
+            partner.write({"member": False, "old_member": True})
+
+    def convert_shares(self, partner, quantity_to, effective_date):
+        """
+        Replace self.quantity shares of the share type of the operation by
+        quantity_to shares of the share to type. The new share line keeps
+        the effective date of the oldest converted line.
+        """
+        partner._lock_shares()
+        plan = self._plan_share_consumption(
+            partner, self.share_product_id, self.quantity
+        )
+        to_remove, to_reduce, share_left = plan
+        dates = [d for d in (to_remove | to_reduce).mapped("effective_date") if d]
+        self._apply_share_consumption(plan)
+        return self.env["share.line"].create(
+            {
+                "share_number": quantity_to,
+                "partner_id": partner.id,
+                "share_product_id": self.share_to_product_id.id,
+                "share_unit_price": self.share_to_unit_price,
+                "effective_date": min(dates) if dates else effective_date,
+            }
+        )
+
+    def has_share_type(self, total_share_dic=None):
+        if total_share_dic is None:
+            total_share_dic = self.get_total_share_dic(self.partner_id)
+        return self.share_product_id.id in total_share_dic
 
     def validate(self):
-        if not self.has_share_type() and self.operation_type in [
+        # the shares of the cooperator and of the receiver are read at once.
+        totals = self.env["share.line"].get_share_totals(
+            self.partner_id | self.partner_id_to
+        )
+        total_share_dic = defaultdict(int, totals[self.partner_id.id])
+        if not self.has_share_type(total_share_dic) and self.operation_type in [
             "sell_back",
             "transfer",
         ]:
@@ -216,8 +278,6 @@ class OperationRequest(models.Model):
             )
 
         if self.operation_type in ["sell_back", "convert", "transfer"]:
-            total_share_dic = self.get_total_share_dic(self.partner_id)
-
             if self.quantity > total_share_dic[self.share_product_id.id]:
                 raise ValidationError(
                     _("The cooperator can't hand over more" " shares that he/she owns.")
@@ -233,22 +293,24 @@ class OperationRequest(models.Model):
                     raise ValidationError(
                         _("You must convert all the shares" " to the selected type.")
                     )
-            else:
-                if self.subscription_amount != self.partner_id.total_value:
-                    raise ValidationError(
-                        _(
-                            "Converting just part of the"
-                            " shares is not yet implemented"
-                        )
+            elif self.share_to_product_id.list_price and (
+                self.subscription_amount % self.share_to_product_id.list_price
+            ):
+                raise ValidationError(
+                    _(
+                        "The converted amount must correspond to a whole"
+                        " number of shares of the new share type."
                     )
+                )
         elif self.operation_type == "transfer":
+            receiver_totals = totals.get(self.partner_id_to.id, {})
             if (
                 not self.receiver_not_member
                 and self.company_id.unmix_share_type
-                and (
-                    self.partner_id_to.cooperator_type
-                    and self.partner_id.cooperator_type
-                    != self.partner_id_to.cooperator_type
+                and any(
+                    share_number > 0
+                    for share_product_id, share_number in receiver_totals.items()
+                    if share_product_id != self.share_product_id.id
                 )
             ):
                 raise ValidationError(
@@ -288,19 +350,26 @@ class OperationRequest(models.Model):
     def _get_share_update_mail_template(self):
         return self.env.ref("cooperator.email_template_share_update", False)
 
+    def _send_share_mail(self, mail_template, partner):
+        # operations executed in batch queue their mails in the outbox.
+        if self.env.context.get("cooperator_queue_mails"):
+            self.env["cooperator.mail.outbox"].enqueue(mail_template, partner)
+        else:
+            mail_template.send_mail(partner.id, False)
+
     def _send_share_transfer_mail(
         self, sub_register_line
     ):  # fixme unused argument is used in synergie project. Do not remove.
         if self.company_id.send_share_transfer_email:
             cert_email_template = self._get_share_transfer_mail_template()
-            cert_email_template.send_mail(self.partner_id_to.id, False)
+            self._send_share_mail(cert_email_template, self.partner_id_to)
 
     def _send_share_update_mail(
         self, sub_register_line
     ):  # fixme unused argument is used in synergie project. Do not remove.
         if self.company_id.send_share_update_email:
             cert_email_template = self._get_share_update_mail_template()
-            cert_email_template.send_mail(self.partner_id.id, False)
+            self._send_share_mail(cert_email_template, self.partner_id)
 
     def get_subscription_register_vals(self, effective_date):
         return {
@@ -312,24 +381,13 @@ class OperationRequest(models.Model):
             "date": effective_date,
         }
 
-    @api.multi
-    def execute_operation(self):
-        self.ensure_one()
-
-        if self.effective_date:
-            effective_date = self.effective_date
-        else:
-            effective_date = self.get_date_now()
-            self.effective_date = effective_date
+    def _apply_operation(self, effective_date):
+        """
+        Modify the share lines and the partners according to the operation,
+        and return the values of the subscription register line recording
+        it, without its operation number.
+        """
         sub_request = self.env["subscription.request"]
-
-        self.validate()
-
-        if self.state != "approved":
-            raise ValidationError(
-                _("This operation must be approved" " before to be executed")
-            )
-
         values = self.get_subscription_register_vals(effective_date)
 
         if self.operation_type == "sell_back":
@@ -340,23 +398,16 @@ class OperationRequest(models.Model):
             remainder = amount_to_convert % self.share_to_product_id.list_price
 
             if convert_quant > 0 and remainder == 0:
-                share_ids = self.partner_id.share_ids
-                line = share_ids[0]
-                if len(share_ids) > 1:
-                    share_ids[1 : len(share_ids)].unlink()
-                line.write(
-                    {
-                        "share_number": convert_quant,
-                        "share_product_id": self.share_to_product_id.id,
-                        "share_unit_price": self.share_to_unit_price,
-                        "share_short_name": self.share_to_short_name,
-                    }
-                )
+                self.convert_shares(self.partner_id, convert_quant, effective_date)
                 values["share_to_product_id"] = self.share_to_product_id.id
                 values["quantity_to"] = convert_quant
+                values["share_to_unit_price"] = self.share_to_unit_price
             else:
                 raise ValidationError(
-                    _("Converting just part of the" " shares is not yet implemented")
+                    _(
+                        "The converted amount must correspond to a whole"
+                        " number of shares of the new share type."
+                    )
                 )
         elif self.operation_type == "transfer":
             sequence_id = self.env.ref("cooperator.sequence_subscription", False)
@@ -399,6 +450,34 @@ class OperationRequest(models.Model):
             values["partner_id_to"] = self.partner_id_to.id
         else:
             raise ValidationError(_("This operation is not yet" " implemented."))
+        return values
+
+    def _check_execution(self):
+        self.validate()
+
+        if self.state != "approved":
+            raise ValidationError(
+                _("This operation must be approved" " before to be executed")
+            )
+        if self.effective_date and self.effective_date > fields.Date.today():
+            raise ValidationError(
+                _("This operation can not be executed before its effective date.")
+            )
+
+    @api.multi
+    def execute_operation(self):
+        self.ensure_one()
+
+        if self.effective_date:
+            effective_date = self.effective_date
+        else:
+            effective_date = self.get_date_now()
+            self.effective_date = effective_date
+
+        (self.partner_id | self.partner_id_to)._lock_shares()
+        self._check_execution()
+
+        values = self._apply_operation(effective_date)
 
         sequence_operation = self.env.ref(
             "cooperator.sequence_register_operation", False
@@ -417,3 +496,213 @@ class OperationRequest(models.Model):
             self._send_share_transfer_mail(sub_register_line)
 
         self._send_share_update_mail(sub_register_line)
+
+    @api.multi
+    def execute_operations(self, skip_locked=False):
+        """
+        Execute the approved operations of self at once, in order of
+        effective date.
+
+        All operations are checked before any of them is executed. An
+        operation that cannot be executed is left approved. The register
+        lines are created with one create() and their operation numbers
+        are allocated at once. The share update and transfer mails are
+        queued in the cooperator mail outbox, through the same hooks as
+        execute_operation().
+
+        The shares of the partners of the operations are locked. With
+        skip_locked, the operations of partners locked by another
+        transaction are left approved, to be executed later, instead of
+        waiting for the lock.
+
+        Return a dict mapping the ids of the operations that could not be
+        executed to an error message.
+        """
+        errors = {}
+        operations = self.filtered(lambda operation: operation.state == "approved")
+        for operation in self - operations:
+            errors[operation.id] = _(
+                "This operation must be approved" " before to be executed"
+            )
+        partners = operations.mapped("partner_id") | operations.mapped(
+            "partner_id_to"
+        )
+        locked_partners = partners._lock_shares(skip_locked=skip_locked)
+        if locked_partners != partners:
+            skipped = operations.filtered(
+                lambda operation: (operation.partner_id | operation.partner_id_to)
+                - locked_partners
+            )
+            _logger.info(
+                "%d operations skipped, their partners are locked", len(skipped)
+            )
+            operations -= skipped
+        today = fields.Date.today()
+        operations.filtered(lambda operation: not operation.effective_date).write(
+            {"effective_date": today}
+        )
+        operations = operations.sorted(
+            lambda operation: (operation.effective_date, operation.id)
+        )
+
+        checked = self.browse()
+        for operation in operations:
+            try:
+                operation._check_execution()
+                checked |= operation
+            except (UserError, ValidationError) as error:
+                errors[operation.id] = error.name
+
+        executed = self.browse()
+        vals_list = []
+        for operation in checked:
+            # an operation can still fail if a previous operation of the
+            # batch changed the shares of the same partner.
+            try:
+                with self.env.cr.savepoint():
+                    vals_list.append(
+                        operation._apply_operation(operation.effective_date)
+                    )
+                executed |= operation
+            except (UserError, ValidationError) as error:
+                # the cache may contain values of the rolled back changes.
+                self.invalidate_cache()
+                errors[operation.id] = error.name
+
+        sequence_operation = self.env.ref(
+            "cooperator.sequence_register_operation", False
+        )
+        sub_reg_operations = sequence_operation.next_by_id_batch(len(vals_list))
+        for values, sub_reg_operation in zip(vals_list, sub_reg_operations):
+            values["name"] = sub_reg_operation
+            values["register_number_operation"] = int(sub_reg_operation)
+
+        executed.write({"state": "done"})
+        sub_register_lines = self.env["subscription.register"].create(vals_list)
+        executed._queue_share_mails(sub_register_lines)
+
+        for operation_id, error in errors.items():
+            _logger.warning("operation %d not executed: %s", operation_id, error)
+        return errors
+
+    @api.multi
+    def action_execute_operations(self):
+        """
+        Execute the operations of self and, if some of them could not be
+        executed, open them.
+        """
+        errors = self.execute_operations()
+        if not errors:
+            return False
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Operations not executed"),
+            "res_model": self._name,
+            "view_mode": "tree,form",
+            "domain": [("id", "in", list(errors))],
+        }
+
+    @api.multi
+    def _queue_share_mails(self, sub_register_lines):
+        """
+        Queue the share transfer and update mails of the operations of self
+        in the cooperator mail outbox. sub_register_lines are the register
+        lines of the operations, in the same order. The mails are sent by
+        the same hooks as execute_operation().
+        """
+        operations = self.with_context(cooperator_queue_mails=True)
+        for operation, sub_register_line in zip(operations, sub_register_lines):
+            if operation.operation_type == "transfer":
+                operation._send_share_transfer_mail(sub_register_line)
+            operation._send_share_update_mail(sub_register_line)
+
+    @api.multi
+    def _execute_operations_in_savepoint(self):
+        """
+        Execute the operations of self with execute_operations(), skipping
+        locked partners. If an unexpected error aborts the batch, execute
+        the operations one by one, so that only the faulty ones are left
+        approved.
+        """
+        try:
+            with self.env.cr.savepoint():
+                return self.execute_operations(skip_locked=True)
+        except Exception:
+            _logger.exception("could not execute operations %s", self.ids)
+            self.invalidate_cache()
+        errors = {}
+        for operation in self:
+            try:
+                with self.env.cr.savepoint():
+                    errors.update(operation.execute_operations(skip_locked=True))
+            except Exception as error:
+                _logger.exception("could not execute operation %d", operation.id)
+                self.invalidate_cache()
+                errors[operation.id] = str(error)
+        return errors
+
+    @api.model
+    def _execute_operations_by_chunks(self, domain, chunk_size):
+        """
+        Execute the operations matching domain, in order of effective date,
+        by chunks of chunk_size operations.
+
+        Each chunk is committed, so that if the execution is interrupted,
+        the next run starts with the operations that are still approved.
+        """
+        total = self.search_count(domain)
+        attempted_ids = []
+        executed_count = 0
+        while True:
+            operations = self.search(
+                domain + [("id", "not in", attempted_ids)],
+                order="effective_date, id",
+                limit=chunk_size,
+            )
+            if not operations:
+                break
+            attempted_ids += operations.ids
+            errors = operations._execute_operations_in_savepoint()
+            executed_count += len(
+                operations.filtered(lambda operation: operation.state == "done")
+            )
+            commit_unless_testing(self.env.cr)
+            _logger.info(
+                "executed %d/%d operations (%d errors in the last chunk)",
+                executed_count,
+                total,
+                len(errors),
+            )
+        return True
+
+    @api.model
+    def execute_approved_operations(self, chunk_size=100):
+        """
+        Execute all the approved operations that are due or have no
+        effective date, by chunks of chunk_size operations. Used by a
+        scheduled action.
+        """
+        domain = [
+            ("state", "=", "approved"),
+            "|",
+            ("effective_date", "=", False),
+            ("effective_date", "<=", fields.Date.today()),
+        ]
+        return self._execute_operations_by_chunks(domain, chunk_size)
+
+    @api.model
+    def execute_due_operations(self, chunk_size=100):
+        """
+        Execute the approved operations whose effective date is today or
+        before, by chunks of chunk_size operations. Used by a scheduled
+        action.
+
+        Operations without effective date are not executed: they are
+        executed manually or by execute_approved_operations().
+        """
+        domain = [
+            ("state", "=", "approved"),
+            ("effective_date", "!=", False),
+            ("effective_date", "<=", fields.Date.today()),
+        ]
+        return self._execute_operations_by_chunks(domain, chunk_size)
@@ -2,8 +2,35 @@
 #   Houssine Bakkali <houssine@coopiteasy.be>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import hashlib
+import re
 
 from odoo import api, fields, models
+from odoo.osv import expression
+from odoo.tools import ormcache
+
+CERTIFICATE_ATTACHMENT_PREFIX = "cooperator_certificate-"
+CERTIFICATE_TEMPLATES = (
+    "cooperator.cooperator_certificat_G001",
+    "cooperator.cooperator_certificat_G001_document",
+)
+
+
+def normalize_email(email):
+    """Return the lower-cased and trimmed email, or False if empty."""
+    if not email:
+        return False
+    return email.strip().lower() or False
+
+
+def normalize_identifier(identifier):
+    """
+    Return the lower-cased identifier (company register number, vat) with
+    everything that is not a letter or a digit removed, or False if empty.
+    """
+    if not identifier:
+        return False
+    return re.sub("[^0-9a-z]+", "", identifier.lower()) or False
 
 
 class ResPartner(models.Model):
@@ -17,6 +44,109 @@ class ResPartner(models.Model):
         else:
             return "unknown"
 
+    @api.model
+    @ormcache("company_id")
+    def _get_certificate_template_version(self, company_id):
+        """
+        Return a string changing whenever the certificate templates (or the
+        views inheriting from them) or the company are modified. The result
+        is cached until a view or a company is modified.
+        """
+        views = self.env["ir.ui.view"].sudo().search(
+            [("key", "in", CERTIFICATE_TEMPLATES)]
+        )
+        children = views.mapped("inherit_children_ids")
+        while children - views:
+            views |= children
+            children = views.mapped("inherit_children_ids")
+        company = self.env["res.company"].sudo().browse(company_id)
+        dates = views.mapped("write_date") + [company.write_date]
+        return str(max(date for date in dates if date))
+
+    @api.multi
+    def _get_certificate_fingerprint(self):
+        """
+        Return a hash of what is shown on the cooperator certificate of the
+        partner: its share lines, the partner itself and the template
+        version.
+        """
+        self.ensure_one()
+        data = [
+            self.write_date,
+            self.commercial_partner_id.write_date,
+            self._get_certificate_template_version(self.company_id.id),
+        ]
+        for line in self.share_ids.sorted("id"):
+            data.append(
+                (
+                    line.id,
+                    line.share_product_id.id,
+                    line.share_short_name,
+                    line.share_number,
+                    line.share_unit_price,
+                    line.effective_date,
+                )
+            )
+        return hashlib.sha1(repr(data).encode("utf-8")).hexdigest()
+
+    @api.multi
+    def get_certificate_attachment_name(self):
+        """
+        Return the name of the attachment in which the cooperator
+        certificate is stored, or False if it must not be stored. As the
+        name depends on the certificate fingerprint, a stored certificate
+        is only reused while the share lines and the template are
+        unchanged.
+        """
+        self.ensure_one()
+        if not self.member or not self.share_ids:
+            return False
+        return "%s%s.pdf" % (
+            CERTIFICATE_ATTACHMENT_PREFIX,
+            self._get_certificate_fingerprint(),
+        )
+
+    @api.multi
+    def _invalidate_certificate_cache(self):
+        """Remove the stored cooperator certificates of the partners."""
+        if not self:
+            return
+        self.env["ir.attachment"].sudo().search(
+            [
+                ("res_model", "=", self._name),
+                ("res_id", "in", self.ids),
+                ("name", "=like", CERTIFICATE_ATTACHMENT_PREFIX + "%"),
+            ]
+        ).unlink()
+
+    @api.multi
+    def _get_partners_and_children(self):
+        """
+        Return a dict mapping the id of each partner of self to the ids of
+        the partner and its active descendants, like a search on child_of,
+        but with a single query for the whole recordset.
+        """
+        self.env.cr.execute(
+            """
+            with recursive partner_tree(root_id, id) as (
+                select id, id
+                from res_partner
+                where id in %s
+                union
+                select partner_tree.root_id, res_partner.id
+                from res_partner
+                join partner_tree on res_partner.parent_id = partner_tree.id
+                where res_partner.active
+            )
+            select root_id, id from partner_tree
+            """,
+            (tuple(self.ids),),
+        )
+        partners_and_children = {partner_id: [] for partner_id in self.ids}
+        for root_id, partner_id in self.env.cr.fetchall():
+            partners_and_children[root_id].append(partner_id)
+        return partners_and_children
+
     @api.multi
     def _invoice_total(self):
         account_invoice_report = self.env["account.invoice.report"]
@@ -24,14 +154,14 @@ class ResPartner(models.Model):
             self.total_invoiced = 0.0
             return True
 
-        all_partners_and_children = {}
-        all_partner_ids = []
-        for partner in self:
-            # price_total is in the company currency
-            all_partners_and_children[partner] = self.search(
-                [("id", "child_of", partner.id)]
-            ).ids
-            all_partner_ids += all_partners_and_children[partner]
+        all_partners_and_children = self._get_partners_and_children()
+        all_partner_ids = list(
+            {
+                partner_id
+                for child_ids in all_partners_and_children.values()
+                for partner_id in child_ids
+            }
+        )
 
         # searching account.invoice.report via the orm is comparatively
         # expensive (generates queries "id in []" forcing to build the
@@ -70,13 +200,25 @@ class ResPartner(models.Model):
         )
 
         self.env.cr.execute(query, where_clause_params)
-        price_totals = self.env.cr.dictfetchall()
-        for partner, child_ids in all_partners_and_children.items():
+        price_totals = {
+            price["partner_id"]: price["total"]
+            for price in self.env.cr.dictfetchall()
+        }
+        for partner in self:
             partner.total_invoiced = sum(
-                price["total"]
-                for price in price_totals
-                if price["partner_id"] in child_ids
+                price_totals.get(child_id, 0.0)
+                for child_id in all_partners_and_children.get(partner.id, [])
+            )
+
+    @api.multi
+    @api.depends("email", "company_register_number", "vat")
+    def _compute_identity_keys(self):
+        for partner in self:
+            partner.email_key = normalize_email(partner.email)
+            partner.company_register_number_key = normalize_identifier(
+                partner.company_register_number
             )
+            partner.vat_key = normalize_identifier(partner.vat)
 
     @api.multi
     @api.depends("share_ids")
@@ -90,9 +232,8 @@ class ResPartner(models.Model):
 
     @api.multi
     def _get_share_type(self):
-        shares = self.env["product.product"].search([("is_share", "=", True)])
-        share_types = [(s.default_code, s.short_name) for s in shares]
-        return [("", "")] + share_types
+        share_types = self.env["product.template"].get_share_types()
+        return [("", "")] + list(share_types)
 
     @api.multi
     @api.depends(
@@ -111,14 +252,14 @@ class ResPartner(models.Model):
             partner.cooperator_type = share_type
 
     @api.multi
-    @api.depends("share_ids")
+    @api.depends("share_ids.share_number", "share_ids.total_amount_line")
     def _compute_share_info(self):
         for partner in self:
             number_of_share = 0
             total_value = 0.0
             for line in partner.share_ids:
                 number_of_share += line.share_number
-                total_value += line.share_unit_price * line.share_number
+                total_value += line.total_amount_line
             partner.number_of_share = number_of_share
             partner.total_value = total_value
 
@@ -145,19 +286,43 @@ class ResPartner(models.Model):
     )
     share_ids = fields.One2many("share.line", "partner_id", string="Share Lines")
     cooperator_register_number = fields.Integer(string="Cooperator Number", copy=False)
+    # stored so that cooperators can be sorted, filtered and grouped by
+    # capital. they are recomputed for the partners of the share lines that
+    # are created, modified or deleted.
     number_of_share = fields.Integer(
         compute="_compute_share_info",
         multi="share",
         string="Number of share",
         readonly=True,
+        store=True,
     )
     total_value = fields.Float(
         compute="_compute_share_info",
         multi="share",
         string="Total value of shares",
         readonly=True,
+        store=True,
     )
     company_register_number = fields.Char(string="Company Register Number")
+    # normalized identities, used to find partners efficiently
+    email_key = fields.Char(
+        string="Normalized email",
+        compute="_compute_identity_keys",
+        store=True,
+        index=True,
+    )
+    company_register_number_key = fields.Char(
+        string="Normalized company register number",
+        compute="_compute_identity_keys",
+        store=True,
+        index=True,
+    )
+    vat_key = fields.Char(
+        string="Normalized tax ID",
+        compute="_compute_identity_keys",
+        store=True,
+        index=True,
+    )
     cooperator_type = fields.Selection(
         selection="_get_share_type",
         compute=_compute_cooperator_type,
@@ -210,16 +375,26 @@ class ResPartner(models.Model):
             partner.coop_candidate = is_candidate
 
     @api.multi
-    @api.depends("parent_id", "parent_id.member", "representative")
+    @api.depends(
+        "parent_id",
+        "parent_id.member",
+        "parent_id.is_company",
+        "representative",
+        "active",
+    )
     def _compute_representative_of_member_company(self):
+        # the parents of the whole recordset are read at once thanks to the
+        # prefetching, instead of searching all member companies for each
+        # partner. child_ids only contains active partners, hence the check
+        # on active.
         for partner in self:
-            member_companies = self.env["res.partner"].search(
-                [("is_company", "=", True), ("member", "=", True)]
-            )
-            representatives = member_companies.mapped("child_ids").filtered(
-                "representative"
+            parent = partner.parent_id
+            partner.representative_of_member_company = bool(
+                partner.representative
+                and partner.active
+                and parent.is_company
+                and parent.member
             )
-            partner.representative_of_member_company = partner in representatives
 
     @api.multi
     def has_representative(self):
@@ -233,34 +408,166 @@ class ResPartner(models.Model):
         self.ensure_one()
         return self.child_ids.filtered("representative")
 
+    def _get_preferred_cooperator(self):
+        """
+        Return the first cooperator of self, or the first partner of self if
+        none of them is a cooperator.
+        """
+        return self.filtered("cooperator")[:1] or self[:1]
+
     def get_cooperator_from_email(self, email):
-        if email:
-            email = email.strip()
+        email_key = normalize_email(email)
         # email could be falsy or be only made of whitespace.
-        if not email:
+        if not email_key:
             return self.browse()
-        partner = self.search(
-            [("cooperator", "=", True), ("email", "=", email)], limit=1
-        )
-        if not partner:
-            partner = self.search([("email", "=", email)], limit=1)
-        return partner
+        partners = self.search([("email_key", "=", email_key)])
+        return partners._get_preferred_cooperator()
 
     def get_cooperator_from_crn(self, company_register_number):
-        if company_register_number:
-            company_register_number = company_register_number.strip()
-        # company_register_number could be falsy or be only made of whitespace.
-        if not company_register_number:
+        crn_key = normalize_identifier(company_register_number)
+        # company_register_number could be falsy or be only made of
+        # whitespace.
+        if not crn_key:
             return self.browse()
-        partner = self.search(
-            [
-                ("cooperator", "=", True),
-                ("company_register_number", "=", company_register_number),
-            ],
-            limit=1,
+        partners = self.search([("company_register_number_key", "=", crn_key)])
+        return partners._get_preferred_cooperator()
+
+    @api.multi
+    def _lock_shares(self, skip_locked=False):
+        """
+        Lock the partners and their share lines until the end of the
+        transaction, so that concurrent changes of the shares of a partner
+        conflict on the partner row instead of both being committed from
+        stale share totals. The rows are locked in order of id, to avoid
+        deadlocks.
+
+        The partners are locked with for no key update, which does not
+        block the inserts of rows referencing them (invoices, move lines,
+        followers...), unlike for update.
+
+        This does not prevent serialization errors: under repeatable read
+        isolation, locking a partner changed by a transaction committed
+        after this one started still raises one, and the transaction must
+        be retried (Odoo does this for requests).
+
+        With skip_locked, the partners locked by another transaction are
+        skipped instead of waited for, so that parallel batch processors
+        work on disjoint partners.
+
+        Return the locked partners.
+        """
+        if not self:
+            return self
+        query = (
+            "select id from res_partner where id in %s"
+            " order by id for no key update"
         )
-        if not partner:
-            partner = self.search(
-                [("company_register_number", "=", company_register_number)], limit=1
+        if skip_locked:
+            query += " skip locked"
+        self.env.cr.execute(query, (tuple(self.ids),))
+        locked = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if locked:
+            self.env.cr.execute(
+                """
+                select id from share_line
+                where partner_id in %s
+                order by id
+                for update
+                """,
+                (tuple(locked.ids),),
             )
-        return partner
+            # the share lines could have been modified before the locks
+            # were acquired.
+            self.env["share.line"].invalidate_cache()
+            locked.invalidate_cache(["share_ids"])
+        return locked
+
+    @api.model
+    def _get_member_export_query(self):
+        """
+        Return the header, the sql query and its parameters used to export
+        the member list.
+        """
+        header = [
+            "cooperator_register_number",
+            "name",
+            "is_company",
+            "email",
+            "phone",
+            "street",
+            "zip",
+            "city",
+            "country",
+            "lang",
+            "effective_date",
+            "number_of_share",
+            "total_value",
+        ]
+        query = """
+            select p.cooperator_register_number,
+                p.name,
+                p.is_company,
+                p.email,
+                p.phone,
+                p.street,
+                p.zip,
+                p.city,
+                c.code,
+                p.lang,
+                p.effective_date,
+                p.number_of_share,
+                p.total_value
+            from res_partner p
+            left join res_country c on c.id = p.country_id
+            where p.member
+                and (p.company_id = %s or p.company_id is null)
+            order by p.cooperator_register_number, p.id
+        """
+        return header, query, [self.env.user.company_id.id]
+
+    @api.model
+    def resolve_cooperators(self, vals_list):
+        """
+        Find the partners matching a list of identities at once.
+
+        Each element of vals_list is a dict like the values used to create a
+        subscription request: companies (is_company) are matched by
+        company_register_number, individuals by email. If several partners
+        match, a cooperator is preferred.
+
+        Return a list of partner recordsets (empty when no partner matches)
+        in the same order as vals_list.
+        """
+        keys = []
+        email_keys = set()
+        crn_keys = set()
+        for vals in vals_list:
+            if vals.get("is_company"):
+                key = normalize_identifier(vals.get("company_register_number"))
+                if key:
+                    crn_keys.add(key)
+                keys.append(("company_register_number_key", key))
+            else:
+                key = normalize_email(vals.get("email"))
+                if key:
+                    email_keys.add(key)
+                keys.append(("email_key", key))
+
+        domains = []
+        if email_keys:
+            domains.append([("email_key", "in", list(email_keys))])
+        if crn_keys:
+            domains.append([("company_register_number_key", "in", list(crn_keys))])
+        matches = {}
+        if domains:
+            wanted_keys = set(keys)
+            for partner in self.search(expression.OR(domains)):
+                for field_name in ("email_key", "company_register_number_key"):
+                    key = (field_name, partner[field_name])
+                    if partner[field_name] and key in wanted_keys:
+                        matches[key] = matches.get(key, self.browse()) | partner
+
+        return [
+            matches.get(key, self.browse())._get_preferred_cooperator()
+            for key in keys
+        ]
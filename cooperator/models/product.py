@@ -4,6 +4,7 @@
 
 
 from odoo import api, fields, models
+from odoo.tools import ormcache
 
 
 class ProductTemplate(models.Model):
@@ -21,22 +22,69 @@ class ProductTemplate(models.Model):
     customer = fields.Boolean(string="Become customer")
     mail_template = fields.Many2one("mail.template", string="Mail template")
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        templates = super().create(vals_list)
+        if templates.filtered("is_share"):
+            self.clear_caches()
+        return templates
+
     @api.multi
-    def get_web_share_products(self, is_company):
+    def write(self, vals):
+        was_share = bool(self.filtered("is_share"))
+        res = super().write(vals)
+        if was_share or self.filtered("is_share"):
+            self.clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        is_share = bool(self.filtered("is_share"))
+        res = super().unlink()
+        if is_share:
+            self.clear_caches()
+        return res
+
+    @api.model
+    @ormcache("self.env.user.company_id.id")
+    def get_share_types(self):
+        """
+        Return a tuple of (default_code, short_name) of the share products.
+        The result is cached until a share product is modified.
+        """
+        shares = self.env["product.product"].search([("is_share", "=", True)])
+        return tuple((s.default_code, s.short_name) for s in shares)
+
+    @api.model
+    @ormcache("is_company", "self.env.user.company_id.id")
+    def _get_web_share_product_ids(self, is_company):
         if is_company is True:
-            product_templates = self.env["product.template"].search(
-                [
-                    ("is_share", "=", True),
-                    ("display_on_website", "=", True),
-                    ("by_company", "=", True),
-                ]
-            )
+            domain = [
+                ("is_share", "=", True),
+                ("display_on_website", "=", True),
+                ("by_company", "=", True),
+            ]
         else:
-            product_templates = self.env["product.template"].search(
-                [
-                    ("is_share", "=", True),
-                    ("display_on_website", "=", True),
-                    ("by_individual", "=", True),
-                ]
-            )
-        return product_templates
+            domain = [
+                ("is_share", "=", True),
+                ("display_on_website", "=", True),
+                ("by_individual", "=", True),
+            ]
+        return tuple(self.env["product.template"].search(domain).ids)
+
+    @api.multi
+    def get_web_share_products(self, is_company):
+        product_ids = self._get_web_share_product_ids(is_company)
+        return self.env["product.template"].browse(product_ids)
+
+
+class ProductProduct(models.Model):
+    _inherit = "product.product"
+
+    @api.multi
+    def write(self, vals):
+        res = super().write(vals)
+        # the default code of share products is cached in get_share_types().
+        if "default_code" in vals and self.filtered("is_share"):
+            self.clear_caches()
+        return res
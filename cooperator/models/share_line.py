@@ -3,6 +3,7 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 from odoo import api, fields, models
+from odoo.tools import create_index
 
 
 class ShareLine(models.Model):
@@ -10,11 +11,10 @@ class ShareLine(models.Model):
     _description = "Share line"
 
     @api.multi
+    @api.depends("share_unit_price", "share_number")
     def _compute_total_line(self):
-        res = {}
         for line in self:
             line.total_amount_line = line.share_unit_price * line.share_number
-        return res
 
     share_product_id = fields.Many2one(
         "product.product", string="Share type", required=True, readonly=True
@@ -32,7 +32,7 @@ class ShareLine(models.Model):
         currency_field="company_currency_id",
         readonly=True,
     )
-    effective_date = fields.Date(string="Effective Date", readonly=True)
+    effective_date = fields.Date(string="Effective Date", readonly=True, index=True)
     partner_id = fields.Many2one(
         "res.partner",
         string="Cooperator",
@@ -44,6 +44,7 @@ class ShareLine(models.Model):
         string="Total amount line",
         currency_field="company_currency_id",
         compute="_compute_total_line",
+        store=True,
     )
     company_id = fields.Many2one(
         "res.company",
@@ -59,3 +60,56 @@ class ShareLine(models.Model):
         related="company_id.currency_id",
         readonly=True,
     )
+
+    @api.model_cr
+    def init(self):
+        create_index(
+            self.env.cr,
+            "share_line_partner_id_share_product_id_index",
+            self._table,
+            ["partner_id", "share_product_id"],
+        )
+
+    @api.model
+    def get_share_totals(self, partners):
+        """
+        Return the number of shares held by each partner for each share
+        type, as a dict {partner_id: {share_product_id: share_number}},
+        computed with one grouped query for all the partners. Partners
+        without shares are mapped to an empty dict.
+        """
+        totals = {partner_id: {} for partner_id in partners.ids}
+        if not totals:
+            return totals
+        self.env.cr.execute(
+            """
+            select partner_id, share_product_id, sum(share_number)
+            from share_line
+            where partner_id in %s
+            group by partner_id, share_product_id
+            """,
+            (tuple(totals),),
+        )
+        for partner_id, share_product_id, share_number in self.env.cr.fetchall():
+            totals[partner_id][share_product_id] = share_number
+        return totals
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines.mapped("partner_id")._invalidate_certificate_cache()
+        return lines
+
+    @api.multi
+    def write(self, vals):
+        partners = self.mapped("partner_id")
+        res = super().write(vals)
+        (partners | self.mapped("partner_id"))._invalidate_certificate_cache()
+        return res
+
+    @api.multi
+    def unlink(self):
+        partners = self.mapped("partner_id")
+        res = super().unlink()
+        partners._invalidate_certificate_cache()
+        return res
@@ -4,12 +4,15 @@
 
 
 from odoo import api, fields, models
+from odoo.tools import create_index
+
+from ..controllers.export import iter_query_rows
 
 
 @api.model
 def _lang_get(self):
-    languages = self.env["res.lang"].search([])
-    return [(language.code, language.name) for language in languages]
+    # get_installed() is cached, and invalidated when languages change.
+    return self.env["res.lang"].get_installed()
 
 
 class SubscriptionRegister(models.Model):
@@ -17,6 +20,7 @@ class SubscriptionRegister(models.Model):
     _description = "Subscription register"
 
     @api.multi
+    @api.depends("share_unit_price", "quantity")
     def _compute_total_line(self):
         for line in self:
             line.total_amount_line = line.share_unit_price * line.quantity
@@ -42,6 +46,7 @@ class SubscriptionRegister(models.Model):
         string="Total amount line",
         currency_field="company_currency_id",
         compute="_compute_total_line",
+        store=True,
     )
     share_product_id = fields.Many2one(
         "product.product",
@@ -105,6 +110,193 @@ class SubscriptionRegister(models.Model):
 
     _order = "register_number_operation asc"
 
+    @api.model_cr
+    def init(self):
+        # used by the holdings computation, which reads all the lines until
+        # a date.
+        create_index(
+            self.env.cr,
+            "subscription_register_date_partner_id_index",
+            self._table,
+            ["date", "partner_id"],
+        )
+
+    @api.model
+    def _movements_from_clause(self):
+        """
+        Return a sql from clause unfolding each register line r into the
+        movements of shares it records, as rows of m(sequence, partner_id,
+        share_product_id, quantity, unit_price): subscriptions add shares to
+        the partner, sell backs remove them, transfers move them from the
+        partner to the receiver and conversions replace them by shares of
+        another type, of the same total value. Movements that do not apply
+        to the line have a null partner_id or share_product_id.
+        """
+        return """
+            subscription_register r
+            cross join lateral (
+                values
+                    (
+                        0,
+                        r.partner_id,
+                        r.share_product_id,
+                        case when r.type = 'subscription'
+                            then r.quantity else -r.quantity end,
+                        r.share_unit_price
+                    ),
+                    (
+                        1,
+                        case when r.type = 'transfer' then r.partner_id_to end,
+                        r.share_product_id,
+                        r.quantity,
+                        r.share_unit_price
+                    ),
+                    (
+                        2,
+                        r.partner_id,
+                        case when r.type = 'convert'
+                            then r.share_to_product_id end,
+                        r.quantity_to,
+                        -- the lines of older conversions have no
+                        -- share_to_unit_price: the converted amount is
+                        -- conserved.
+                        coalesce(
+                            nullif(r.share_to_unit_price, 0),
+                            r.quantity * r.share_unit_price
+                                / nullif(r.quantity_to, 0)
+                        )
+                    )
+            ) as m(sequence, partner_id, share_product_id, quantity, unit_price)
+        """
+
+    @api.model
+    def _get_holdings_query(
+        self, date, limit=None, after=None, share_product_ids=None
+    ):
+        """
+        Return the sql query computing the holdings on date, and its
+        parameters. See get_holdings().
+        """
+        where_clauses = []
+        params = {
+            "date": date,
+            "company_id": self.env.user.company_id.id,
+            "limit": limit,
+        }
+        if after:
+            where_clauses.append(
+                "(m.partner_id, m.share_product_id)"
+                " > (%(after_partner_id)s, %(after_share_product_id)s)"
+            )
+            params["after_partner_id"], params["after_share_product_id"] = after
+        if share_product_ids:
+            where_clauses.append("m.share_product_id in %(share_product_ids)s")
+            params["share_product_ids"] = tuple(share_product_ids)
+        extra_where = "".join(" and " + clause for clause in where_clauses)
+        # every register line is read once and unfolded into the movements
+        # of shares it records.
+        query = (
+            """
+            select m.partner_id,
+                m.share_product_id,
+                sum(m.quantity) as quantity,
+                sum(m.quantity * coalesce(m.unit_price, 0)) as amount
+            from"""
+            + self._movements_from_clause()
+            + """
+            where r.date <= %(date)s
+                and r.company_id = %(company_id)s
+                and m.partner_id is not null
+                and m.share_product_id is not null"""
+            + extra_where
+            + """
+            group by m.partner_id, m.share_product_id
+            having sum(m.quantity) != 0
+            order by m.partner_id, m.share_product_id
+            limit %(limit)s
+            """
+        )
+        return query, params
+
+    @api.model
+    def get_holdings(self, date, limit=None, after=None, share_product_ids=None):
+        """
+        Return the shares held by each partner on date, computed from the
+        movements of shares recorded by the register lines.
+
+        Return a list of dicts with the keys partner_id, share_product_id,
+        quantity and amount, ordered by partner and share type. Only non
+        zero holdings are returned. The result is paginated by giving limit
+        and, to get the next page, after: the (partner_id,
+        share_product_id) tuple of the last row of the previous page.
+        """
+        query, params = self._get_holdings_query(
+            date, limit=limit, after=after, share_product_ids=share_product_ids
+        )
+        self.env.cr.execute(query, params)
+        return self.env.cr.dictfetchall()
+
+    @api.model
+    def _get_export_query(self):
+        """
+        Return the header, the sql query and its parameters used to export
+        the register.
+        """
+        header = [
+            "register_number_operation",
+            "date",
+            "type",
+            "cooperator_register_number",
+            "partner",
+            "share_type",
+            "quantity",
+            "share_unit_price",
+            "total_amount_line",
+            "partner_to",
+            "share_to_type",
+            "quantity_to",
+            "share_to_unit_price",
+        ]
+        query = """
+            select r.register_number_operation,
+                r.date,
+                r.type,
+                p.cooperator_register_number,
+                p.name,
+                t.short_name,
+                r.quantity,
+                r.share_unit_price,
+                r.total_amount_line,
+                pt.name,
+                tt.short_name,
+                r.quantity_to,
+                r.share_to_unit_price
+            from subscription_register r
+            join res_partner p on p.id = r.partner_id
+            join product_product pp on pp.id = r.share_product_id
+            join product_template t on t.id = pp.product_tmpl_id
+            left join res_partner pt on pt.id = r.partner_id_to
+            left join product_product ppt on ppt.id = r.share_to_product_id
+            left join product_template tt on tt.id = ppt.product_tmpl_id
+            where r.company_id = %s
+            order by r.register_number_operation, r.id
+        """
+        return header, query, [self.env.user.company_id.id]
+
+    @api.model
+    def iter_holdings(self, date, page_size=10000, share_product_ids=None):
+        """
+        Yield the holdings on date like get_holdings(). The query is run
+        once and its rows are fetched by batches of page_size rows through a
+        server-side cursor.
+        """
+        query, params = self._get_holdings_query(
+            date, share_product_ids=share_product_ids
+        )
+        keys = ("partner_id", "share_product_id", "quantity", "amount")
+        for row in iter_query_rows(self.env.cr, query, params, itersize=page_size):
+            yield dict(zip(keys, row))
+
     @api.model
     def read_group(
         self,
@@ -120,7 +312,8 @@ class SubscriptionRegister(models.Model):
             fields.remove("share_unit_price")
         if "register_number_operation" in fields:
             fields.remove("register_number_operation")
-        res = super().read_group(
+        # total_amount_line is stored, so it is summed by the grouped query.
+        return super().read_group(
             domain,
             fields,
             groupby,
@@ -129,12 +322,3 @@ class SubscriptionRegister(models.Model):
             orderby=orderby,
             lazy=lazy,
         )
-        if "total_amount_line" in fields:
-            for line in res:
-                if "__domain" in line:
-                    lines = self.search(line["__domain"])
-                    inv_value = 0.0
-                    for line2 in lines:
-                        inv_value += line2.total_amount_line
-                    line["total_amount_line"] = inv_value
-        return res
@@ -7,9 +7,12 @@ from datetime import date
 
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import ormcache
 
 from odoo.addons.base_iban.models.res_partner_bank import validate_iban
 
+from .partner import normalize_email, normalize_identifier
+
 _REQUIRED = [
     "email",
     "firstname",
@@ -29,8 +32,8 @@ _REQUIRED = [
 
 @api.model
 def _lang_get(self):
-    languages = self.env["res.lang"].search([])
-    return [(language.code, language.name) for language in languages]
+    # get_installed() is cached, and invalidated when languages change.
+    return self.env["res.lang"].get_installed()
 
 
 class SubscriptionRequest(models.Model):
@@ -38,9 +41,13 @@ class SubscriptionRequest(models.Model):
     _description = "Subscription Request"
     _inherit = ["mail.thread", "mail.activity.mixin"]
 
-    def get_required_field(self):
+    @api.model
+    @ormcache("company_id")
+    def _get_company_required_fields(self, company_id):
+        # the cache is cleared by res.company.write(), so changes to the
+        # approval settings are taken into account.
         required_fields = _REQUIRED.copy()
-        company = self.env["res.company"]._company_default_get()
+        company = self.env["res.company"].browse(company_id)
         if company.data_policy_approval_required:
             required_fields.append("data_policy_approved")
         if company.internal_rules_approval_required:
@@ -49,7 +56,11 @@ class SubscriptionRequest(models.Model):
             required_fields.append("financial_risk_approved")
         if company.generic_rules_approval_required:
             required_fields.append("generic_rules_approved")
-        return required_fields
+        return tuple(required_fields)
+
+    def get_required_field(self):
+        company = self.env["res.company"]._company_default_get()
+        return list(self._get_company_required_fields(company.id))
 
     def get_mail_template_notif(self, is_company=False):
         if is_company:
@@ -77,52 +88,83 @@ class SubscriptionRequest(models.Model):
             mail_template_notif = self.get_mail_template_notif(
                 is_company=self.is_company
             )
-            # sudo is needed to change state of invoice linked to a request
-            #  sent through the api
-            mail_template_notif.sudo().send_mail(self.id)
+            if self.company_id.confirmation_email_mode == "deferred":
+                self.env["cooperator.mail.outbox"].enqueue(mail_template_notif, self)
+            else:
+                # sudo is needed to change state of invoice linked to a request
+                #  sent through the api
+                mail_template_notif.sudo().send_mail(self.id)
 
     def _find_partner_from_create_vals(self, vals):
         """
-        Find the partner corresponding to the vals dict.
+        Find the partner corresponding to the vals dict. Kept for
+        compatibility: it calls _find_partners_from_create_vals_list(),
+        which should be extended instead.
+        """
+        return self._find_partners_from_create_vals_list([vals])[0]
+
+    def _find_partners_from_create_vals_list(self, vals_list):
+        """
+        Find the partners corresponding to each vals dict of vals_list.
 
-        If partner_id is present in the dict, use it to find the partner.
+        If partner_id is present in a dict, use it to find the partner.
         Otherwise, search companies by register number and individuals by
-        email address. If a match is found, add partner_id in the dict.
+        email address, with a single search for all the vals dicts without
+        partner_id. If a match is found, add partner_id in the dict.
+
+        Return a list of partner recordsets in the same order as vals_list.
         """
         partner_model = self.env["res.partner"]
-        partner_id = vals.get("partner_id")
-        if partner_id:
-            return partner_model.browse(partner_id)
-        if vals.get("is_company"):
-            partner = partner_model.get_cooperator_from_crn(
-                vals.get("company_register_number")
+        partners = [
+            partner_model.browse(vals.get("partner_id")) for vals in vals_list
+        ]
+        to_resolve = [
+            index for index, vals in enumerate(vals_list) if not vals.get("partner_id")
+        ]
+        if to_resolve:
+            resolved = partner_model.resolve_cooperators(
+                [vals_list[index] for index in to_resolve]
             )
-        else:
-            partner = partner_model.get_cooperator_from_email(vals.get("email"))
-        if partner:
-            vals["partner_id"] = partner.id
-        return partner
-
-    @api.model
-    def create(self, vals):
-        partner = self._find_partner_from_create_vals(vals)
-        if partner:
-            pending_requests_domain = [
-                ("partner_id", "=", partner.id),
+            for index, partner in zip(to_resolve, resolved):
+                partners[index] = partner
+                if partner:
+                    vals_list[index]["partner_id"] = partner.id
+        return partners
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        partners = self._find_partners_from_create_vals_list(vals_list)
+        partner_ids = {partner.id for partner in partners if partner}
+
+        # we don't use partner.coop_candidate because we want to also
+        # handle draft and waiting requests.
+        pending_requests = self.search(
+            [
+                ("partner_id", "in", list(partner_ids)),
                 ("state", "in", ("draft", "waiting", "done")),
             ]
-            # we don't use partner.coop_candidate because we want to also
-            # handle draft and waiting requests.
-            if partner.member or self.search(pending_requests_domain):
+        )
+        pending_partner_ids = set(pending_requests.mapped("partner_id").ids)
+        partners_to_flag = self.env["res.partner"]
+        for vals, partner in zip(vals_list, partners):
+            if not partner:
+                continue
+            if partner.member or partner.id in pending_partner_ids:
                 vals["type"] = "increase"
             if partner.member:
                 vals["already_cooperator"] = True
             if not partner.cooperator:
-                partner.cooperator = True
-
-        subscription_request = super().create(vals)
-        subscription_request._send_confirmation_mail()
-        return subscription_request
+                partners_to_flag |= partner
+            # requests created in this batch are pending for the next ones.
+            pending_partner_ids.add(partner.id)
+        if partners_to_flag:
+            partners_to_flag.write({"cooperator": True})
+
+        subscription_requests = super().create(vals_list)
+        if not self.env.context.get("cooperator_skip_confirmation_mail"):
+            for subscription_request in subscription_requests:
+                subscription_request._send_confirmation_mail()
+        return subscription_requests
 
     @api.model
     def create_comp_sub_req(self, vals):
@@ -573,17 +615,20 @@ class SubscriptionRequest(models.Model):
 
         return invoice_vals
 
-    def create_invoice(self, partner):
-        # creating invoice and invoice lines
+    def _prepare_capital_release_request_vals(self, partner):
         invoice_vals = self.get_invoice_vals(partner)
         if self.capital_release_request_date:
             invoice_vals["date_invoice"] = self.capital_release_request_date
-        invoice = self.env["account.invoice"].create(invoice_vals)
-        vals = self._prepare_invoice_line(
+        line_vals = self._prepare_invoice_line(
             self.share_product_id, partner, self.ordered_parts
         )
-        vals["invoice_id"] = invoice.id
-        self.env["account.invoice.line"].create(vals)
+        invoice_vals["invoice_line_ids"] = [(0, 0, line_vals)]
+        return invoice_vals
+
+    def create_invoice(self, partner):
+        # creating invoice and invoice lines
+        invoice_vals = self._prepare_capital_release_request_vals(partner)
+        invoice = self.env["account.invoice"].create(invoice_vals)
 
         # validate the capital release request
         invoice.action_invoice_open()
@@ -687,48 +732,97 @@ class SubscriptionRequest(models.Model):
         pass
 
     def _get_partner_domain(self):
-        if self.email:
-            return [("email", "=", self.email)]
+        email_key = normalize_email(self.email)
+        if email_key:
+            return [("email_key", "=", email_key)]
         else:
             return None
 
-    @api.multi
-    def validate_subscription_request(self):
-        # todo rename to validate (careful with iwp dependencies)
-        self.ensure_one()
+    def _get_validation_partner_domain(self):
+        """
+        Return the domain used to find an existing partner for this request
+        when it is validated and has no partner_id.
+        """
+        crn_key = normalize_identifier(self.company_register_number)
+        if self.is_company and crn_key:
+            return [("company_register_number_key", "=", crn_key)]
+        elif not self.is_company:
+            return self._get_partner_domain()
+        return None
+
+    def _find_validation_partners(self):
+        """
+        Find the existing partners of all requests of self that have no
+        partner_id, grouping the lookups to avoid a search per request.
+
+        Domains made of a single equality leaf (the default ones) are
+        resolved with one search per field. Other domains, which can be
+        returned by overrides of _get_partner_domain(), are searched one by
+        one.
+
+        Return a dict mapping request ids to partner recordsets.
+        """
+        partner_model = self.env["res.partner"]
+        partners = {}
+        values_per_field = {}
+        for request in self:
+            if request.partner_id or request.already_cooperator:
+                continue
+            domain = request._get_validation_partner_domain()
+            if not domain:
+                continue
+            if len(domain) == 1 and domain[0][1] == "=":
+                field_name, _operator, value = domain[0]
+                request_ids = values_per_field.setdefault(field_name, {})
+                request_ids.setdefault(value, []).append(request.id)
+                partners[request.id] = partner_model
+            else:
+                partners[request.id] = partner_model.search(domain)
+        for field_name, request_ids in values_per_field.items():
+            for partner in partner_model.search(
+                [(field_name, "in", list(request_ids))]
+            ):
+                for request_id in request_ids.get(partner[field_name], []):
+                    partners[request_id] = (
+                        partners.get(request_id, partner_model) | partner
+                    )
+        return partners
+
+    def _check_validation(self):
+        """
+        Raise an error if the request cannot be validated. Called for each
+        request by both validate() and validate_subscription_request(): extend
+        it to add validation constraints.
+        """
         if self.state not in ("draft", "waiting"):
             raise ValidationError(
                 _("The request must be in draft or on waiting list to be validated")
             )
+        if self.ordered_parts <= 0:
+            raise UserError(_("Number of share must be greater than 0."))
+
+    def _get_validation_partner(self, partner=None):
+        """
+        Return the partner of the request, creating it (and its
+        representative for companies) if needed.
 
+        partner can be given when it was found beforehand, for example by
+        _find_validation_partners(). Otherwise, it is searched.
+        """
         partner_obj = self.env["res.partner"]
 
-        if self.ordered_parts <= 0:
-            raise UserError(_("Number of share must be greater than 0."))
         if self.partner_id:
             partner = self.partner_id
             self.update_partner_info()  # hook
-        else:
-            partner = None
-            domain = []
-            if self.already_cooperator:
-                raise UserError(
-                    _(
-                        "The checkbox already cooperator is"
-                        " checked please select a cooperator."
-                    )
+        elif self.already_cooperator:
+            raise UserError(
+                _(
+                    "The checkbox already cooperator is"
+                    " checked please select a cooperator."
                 )
-            elif self.is_company and self.company_register_number:
-                domain = [
-                    (
-                        "company_register_number",
-                        "=",
-                        self.company_register_number,
-                    )
-                ]  # noqa
-            elif not self.is_company:
-                domain = self._get_partner_domain()
-
+            )
+        elif partner is None:
+            domain = self._get_validation_partner_domain()
             if domain:
                 partner = partner_obj.search(domain)
 
@@ -770,12 +864,117 @@ class SubscriptionRequest(models.Model):
                 else:
                     contact.write({"parent_id": partner.id, "representative": True})
 
+        return partner
+
+    @api.multi
+    def validate_subscription_request(self):
+        # todo rename to validate (careful with iwp dependencies)
+        self.ensure_one()
+        self._check_validation()
+        partner = self._get_validation_partner()
+
         invoice = self.create_invoice(partner)
         self.write({"state": "done"})
         self.set_membership()
 
         return invoice
 
+    def _create_invoices(self, partners, errors):
+        """
+        Create and open the capital release requests of self together.
+        account.invoice.create() is not multi in this version, so the
+        invoices are still created one by one, but they are opened with one
+        action_invoice_open() call.
+
+        partners maps request ids to their partner. If the creation fails,
+        fall back to creating and opening the invoices one by one so that
+        only the faulty requests are reported in errors.
+        """
+        invoice_model = self.env["account.invoice"]
+        try:
+            with self.env.cr.savepoint():
+                invoices = invoice_model.create(
+                    [
+                        request._prepare_capital_release_request_vals(
+                            partners[request.id]
+                        )
+                        for request in self
+                    ]
+                )
+                invoices.action_invoice_open()
+            return invoices
+        except (UserError, ValidationError):
+            invoices = invoice_model
+            for request in self:
+                try:
+                    with self.env.cr.savepoint():
+                        invoice = invoice_model.create(
+                            request._prepare_capital_release_request_vals(
+                                partners[request.id]
+                            )
+                        )
+                        invoice.action_invoice_open()
+                    invoices |= invoice
+                except (UserError, ValidationError) as error:
+                    errors[request.id] = error.name
+            return invoices
+
+    @api.multi
+    def validate(self):
+        """
+        Validate all the requests of self at once.
+
+        Partners are looked up for the whole batch, and the capital release
+        requests are created and opened together. A request that cannot be
+        validated, or whose capital release request cannot be sent, does not
+        prevent the others from being validated: the error is posted on it
+        instead.
+
+        Return a dict mapping the ids of the requests that could not be
+        validated to their error message.
+        """
+        errors = {}
+        partners = {}
+        found_partners = self._find_validation_partners()
+        # partners created for requests of this batch, by lookup domain, so
+        # that requests sharing an identity get the same partner.
+        created_partners = {}
+        for request in self:
+            partner = found_partners.get(request.id)
+            domain_key = None
+            if partner is not None and not partner:
+                domain_key = repr(request._get_validation_partner_domain())
+                partner = created_partners.get(domain_key, partner)
+            try:
+                with self.env.cr.savepoint():
+                    request._check_validation()
+                    partners[request.id] = request._get_validation_partner(partner)
+            except (UserError, ValidationError) as error:
+                errors[request.id] = error.name
+                continue
+            if domain_key is not None:
+                created_partners.setdefault(domain_key, partners[request.id])
+
+        requests = self.filtered(lambda record: record.id in partners)
+        invoices = requests._create_invoices(partners, errors)
+
+        for invoice in invoices:
+            request = invoice.subscription_request
+            try:
+                with self.env.cr.savepoint():
+                    invoice.send_capital_release_request_mail()
+                    request.write({"state": "done"})
+                    request.set_membership()
+            except (UserError, ValidationError) as error:
+                self.invalidate_cache()
+                errors[request.id] = error.name
+
+        for request in self.filtered(lambda record: record.id in errors):
+            request.message_post(
+                body=_("The request could not be validated: %s") % errors[request.id]
+            )
+        return errors
+
     @api.multi
     def block_subscription_request(self):
         self.ensure_one()
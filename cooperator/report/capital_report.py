@@ -0,0 +1,102 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class CooperatorCapitalReport(models.Model):
+    """
+    Capital analysis, computed from the movements of shares recorded in the
+    subscription register.
+
+    The report is backed by a materialized view, so that the pivot and
+    graph views do not read the register. The view is refreshed by a
+    scheduled action.
+    """
+
+    _name = "cooperator.capital.report"
+    _description = "Capital analysis"
+    _auto = False
+    _order = "date desc"
+
+    date = fields.Date(string="Date", readonly=True)
+    type = fields.Selection(
+        [
+            ("subscription", "Subscription"),
+            ("transfer", "Transfer"),
+            ("sell_back", "Sell Back"),
+            ("convert", "Conversion"),
+        ],
+        string="Operation Type",
+        readonly=True,
+    )
+    share_product_id = fields.Many2one(
+        "product.product", string="Share type", readonly=True
+    )
+    partner_id = fields.Many2one("res.partner", string="Cooperator", readonly=True)
+    country_id = fields.Many2one("res.country", string="Country", readonly=True)
+    is_company = fields.Boolean(string="Is a company", readonly=True)
+    company_id = fields.Many2one("res.company", string="Company", readonly=True)
+    company_currency_id = fields.Many2one(
+        "res.currency", string="Company Currency", readonly=True
+    )
+    quantity = fields.Integer(string="Number of shares", readonly=True)
+    amount = fields.Monetary(
+        string="Capital", currency_field="company_currency_id", readonly=True
+    )
+
+    def _query(self):
+        return (
+            """
+            select r.id * 3 + m.sequence as id,
+                r.date,
+                r.type,
+                m.share_product_id,
+                m.partner_id,
+                p.country_id,
+                coalesce(p.is_company, false) as is_company,
+                r.company_id,
+                c.currency_id as company_currency_id,
+                m.quantity,
+                m.quantity * coalesce(m.unit_price, 0) as amount
+            from"""
+            + self.env["subscription.register"]._movements_from_clause()
+            + """
+            join res_partner p on p.id = m.partner_id
+            join res_company c on c.id = r.company_id
+            where m.share_product_id is not null
+            """
+        )
+
+    @api.model_cr
+    def init(self):
+        self.env.cr.execute(
+            "drop materialized view if exists %s cascade" % self._table
+        )
+        self.env.cr.execute(
+            "create materialized view %s as (%s)" % (self._table, self._query())
+        )
+        # a unique index is needed to refresh the view concurrently.
+        self.env.cr.execute(
+            "create unique index %s_id_index on %s (id)" % (self._table, self._table)
+        )
+        self.env.cr.execute(
+            "create index %s_date_index on %s (date)" % (self._table, self._table)
+        )
+
+    @api.model
+    def refresh_materialized_view(self):
+        """
+        Refresh the report without locking it, so that it can still be read
+        while being refreshed.
+        """
+        self.env.cr.execute(
+            "refresh materialized view concurrently %s" % self._table
+        )
+        self.invalidate_cache()
+        _logger.info("refreshed %s", self._table)
+        return True
@@ -1 +1,2 @@
 from . import test_cooperator
+from . import test_performance
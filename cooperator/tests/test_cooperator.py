@@ -2,12 +2,15 @@
 #   Robin Keunen <robin@coopiteasy.be>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import io
 from datetime import date, datetime, timedelta
 
-from odoo.exceptions import AccessError
+from odoo.exceptions import AccessError, ValidationError
 from odoo.fields import Date
 from odoo.tests.common import SavepointCase, users
+from odoo.tools import mute_logger
 
+from ..controllers.export import iter_csv, iter_query_rows
 from .cooperator_test_mixin import CooperatorTestMixin
 
 
@@ -498,3 +501,886 @@ class CooperatorCase(SavepointCase, CooperatorTestMixin):
         subscription_request = self.env["subscription.request"].create(vals)
         partner = subscription_request.partner_id
         self.assertNotEqual(partner, company_partner)
+
+    def test_validate_multiple_subscription_requests(self):
+        vals = self.get_dummy_subscription_requests_vals()
+        request_1 = self.env["subscription.request"].create(vals)
+        vals["email"] = "other@example.net"
+        request_2 = self.env["subscription.request"].create(vals)
+        vals["email"] = "wrong@example.net"
+        vals["ordered_parts"] = 0
+        request_3 = self.env["subscription.request"].create(vals)
+        requests = request_1 | request_2 | request_3
+        errors = requests.validate()
+        self.assertEqual(list(errors), [request_3.id])
+        self.assertEqual(request_1.state, "done")
+        self.assertEqual(request_2.state, "done")
+        self.assertEqual(request_3.state, "draft")
+        self.assertEqual(request_1.capital_release_request.state, "open")
+        self.assertEqual(request_2.capital_release_request.state, "open")
+        self.assertFalse(request_3.capital_release_request)
+        self.assertNotEqual(request_1.partner_id, request_2.partner_id)
+
+    def test_validate_subscription_requests_with_same_email(self):
+        vals = self.get_dummy_subscription_requests_vals()
+        vals["email"] = "same@example.net"
+        requests = self.env["subscription.request"].create([vals, dict(vals)])
+        self.assertFalse(requests.mapped("partner_id"))
+        errors = requests.validate()
+        self.assertFalse(errors)
+        self.assertEqual(len(requests.mapped("partner_id")), 1)
+        self.assertEqual(
+            self.env["res.partner"].search_count(
+                [("email", "=", "same@example.net")]
+            ),
+            1,
+        )
+
+    def test_validate_subscription_requests_with_matching_email(self):
+        partner = self.env["res.partner"].create(
+            {
+                "name": "dummy partner 1",
+                "email": "dummy@example.net",
+            }
+        )
+        vals = self.get_dummy_subscription_requests_vals()
+        vals["email"] = "dummy@example.net"
+        subscription_request = self.env["subscription.request"].create(vals)
+        # the partner is matched at creation, unset it to check the matching
+        # done at validation.
+        subscription_request.partner_id = False
+        subscription_request.validate()
+        self.assertEqual(subscription_request.partner_id, partner)
+        self.assertEqual(subscription_request.state, "done")
+
+    def test_deferred_confirmation_mail(self):
+        self.company.confirmation_email_mode = "deferred"
+        outbox_model = self.env["cooperator.mail.outbox"]
+        mail_model = self.env["mail.mail"]
+        mail_count = mail_model.search_count([])
+        subscription_request = self.env["subscription.request"].create(
+            self.get_dummy_subscription_requests_vals()
+        )
+        rows = outbox_model.search([("res_id", "=", subscription_request.id)])
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows.res_model, "subscription.request")
+        self.assertEqual(
+            rows.template_id,
+            self.env.ref("cooperator.email_template_confirmation"),
+        )
+        self.assertEqual(mail_model.search_count([]), mail_count)
+        outbox_model.send_queued_mails()
+        self.assertFalse(outbox_model.search([]))
+        self.assertEqual(mail_model.search_count([]), mail_count + 1)
+
+    def test_failing_queued_mail(self):
+        outbox_model = self.env["cooperator.mail.outbox"]
+        subscription_request = self.env["subscription.request"].create(
+            self.get_dummy_subscription_requests_vals()
+        )
+        broken_template = self.env["mail.template"].create(
+            {
+                "name": "broken template",
+                "model_id": self.env.ref(
+                    "cooperator.model_subscription_request"
+                ).id,
+                "subject": "${object.no_such_field.name}",
+                "body_html": "<p>broken</p>",
+            }
+        )
+        outbox_model.enqueue(broken_template, subscription_request)
+        outbox_model.enqueue(
+            self.env.ref("cooperator.email_template_confirmation"),
+            subscription_request,
+        )
+        outbox_model.send_queued_mails()
+        rows = outbox_model.search([])
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows.template_id, broken_template)
+        self.assertTrue(rows.failed)
+        self.assertTrue(rows.error)
+        # the failed row is not retried by the next runs.
+        outbox_model.send_queued_mails()
+        self.assertEqual(outbox_model.search([]), rows)
+
+    def test_deferred_capital_release_request_mail(self):
+        self.company.capital_release_email_mode = "deferred"
+        self.subscription_request_1.validate_subscription_request()
+        invoice = self.subscription_request_1.capital_release_request
+        self.assertEqual(invoice.state, "open")
+        self.assertEqual(invoice.capital_release_mail_state, "pending")
+        self.assertFalse(invoice.sent)
+        self.env["account.invoice"].process_capital_release_requests()
+        self.assertEqual(invoice.capital_release_mail_state, "sent")
+        self.assertTrue(invoice.sent)
+
+    def test_retry_failed_capital_release_request_mail(self):
+        self.company.capital_release_email_mode = "deferred"
+        self.subscription_request_1.validate_subscription_request()
+        invoice = self.subscription_request_1.capital_release_request
+        invoice.capital_release_mail_state = "failed"
+        self.env["account.invoice"].process_capital_release_requests()
+        self.assertEqual(invoice.capital_release_mail_state, "failed")
+        invoice.action_retry_capital_release_mail()
+        self.assertEqual(invoice.capital_release_mail_state, "pending")
+        self.env["account.invoice"].process_capital_release_requests()
+        self.assertEqual(invoice.capital_release_mail_state, "sent")
+
+    def test_get_cooperator_from_normalized_identities(self):
+        partner = self.env["res.partner"].create(
+            {
+                "name": "dummy partner 1",
+                "email": " Dummy@Example.net ",
+            }
+        )
+        company_partner = self.env["res.partner"].create(
+            {
+                "name": "dummy company",
+                "company_register_number": "BE 0123.456.789",
+                "is_company": True,
+            }
+        )
+        partner_model = self.env["res.partner"]
+        self.assertEqual(
+            partner_model.get_cooperator_from_email("dummy@example.NET"), partner
+        )
+        self.assertEqual(
+            partner_model.get_cooperator_from_crn("be0123456789"), company_partner
+        )
+        results = partner_model.resolve_cooperators(
+            [
+                {"email": "DUMMY@example.net"},
+                {"is_company": True, "company_register_number": "BE0123456789"},
+                {"email": "unknown@example.net"},
+                {"email": " "},
+            ]
+        )
+        self.assertEqual(
+            results,
+            [partner, company_partner, partner_model, partner_model],
+        )
+
+    def test_create_multiple_subscription_requests_at_once(self):
+        partner = self.env["res.partner"].create(
+            {
+                "name": "dummy partner 1",
+                "email": "dummy@example.net",
+            }
+        )
+        vals = self.get_dummy_subscription_requests_vals()
+        vals["email"] = "dummy@example.net"
+        other_vals = self.get_dummy_subscription_requests_vals()
+        other_vals["email"] = "other@example.net"
+        requests = self.env["subscription.request"].create(
+            [vals, dict(vals), other_vals]
+        )
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(requests[0].partner_id, partner)
+        self.assertEqual(requests[1].partner_id, partner)
+        self.assertFalse(requests[2].partner_id)
+        self.assertEqual(requests.mapped("type"), ["new", "increase", "new"])
+        self.assertTrue(partner.cooperator)
+
+    def test_import_subscription_requests_from_csv(self):
+        header = (
+            "firstname,lastname,email,birthdate,gender,address,zip_code,city,"
+            "country_id,lang,iban,share_product_id,ordered_parts"
+        )
+        row = (
+            "first name,last name,{email},1980-01-01,other,dummy street,"
+            "1000,Brussels,BE,en_US,{iban},%d,2" % self.share_y.id
+        )
+        content = "\n".join(
+            [
+                header,
+                row.format(email="import1@example.net", iban="BE60096123456870"),
+                row.format(email="", iban="BE60096123456870"),
+                row.format(email="import2@example.net", iban="xxxx"),
+                row.format(email="import3@example.net", iban="BE60096123456870"),
+            ]
+        )
+        report = io.StringIO()
+        imported, rejected = self.env["subscription.request.import"].import_file(
+            io.BytesIO(content.encode("utf-8")), "csv", chunk_size=1, report=report
+        )
+        self.assertEqual((imported, rejected), (2, 2))
+        requests = self.env["subscription.request"].search(
+            [("email", "in", ["import1@example.net", "import3@example.net"])]
+        )
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[0].country_id, self.browse_ref("base.be"))
+        self.assertEqual(requests[0].ordered_parts, 2)
+        self.assertEqual(len(report.getvalue().splitlines()), 3)
+
+    def test_import_subscription_requests_with_unknown_reference(self):
+        header = (
+            "firstname,lastname,email,birthdate,gender,address,zip_code,city,"
+            "country_id,lang,iban,share_product_id,ordered_parts"
+        )
+        row = (
+            "first name,last name,{email},1980-01-01,other,dummy street,"
+            "1000,Brussels,BE,en_US,BE60096123456870,{share_product_id},2"
+        )
+        content = "\n".join(
+            [
+                header,
+                row.format(email="import1@example.net", share_product_id=99999999),
+                row.format(
+                    email="import2@example.net", share_product_id=self.share_y.id
+                ),
+            ]
+        )
+        mail_count = self.env["mail.mail"].search_count([])
+        report = io.StringIO()
+        with mute_logger("odoo.sql_db"):
+            imported, rejected = self.env["subscription.request.import"].import_file(
+                io.BytesIO(content.encode("utf-8")), "csv", report=report
+            )
+        self.assertEqual((imported, rejected), (1, 1))
+        self.assertIn("import1@example.net", report.getvalue())
+        # no confirmation email is sent by default.
+        self.assertEqual(self.env["mail.mail"].search_count([]), mail_count)
+
+    def test_share_types_cache_invalidation(self):
+        partner_model = self.env["res.partner"]
+        share_types = partner_model._get_share_type()
+        share_z = self.env["product.product"].create(
+            {
+                "name": "Share Z - Supporter",
+                "short_name": "Part Z",
+                "default_code": "part_z",
+                "is_share": True,
+                "by_individual": True,
+                "display_on_website": True,
+                "list_price": 10,
+            }
+        )
+        self.assertIn(("part_z", "Part Z"), partner_model._get_share_type())
+        self.assertEqual(len(partner_model._get_share_type()), len(share_types) + 1)
+        web_products = self.env["product.template"].get_web_share_products(False)
+        self.assertIn(share_z.product_tmpl_id, web_products)
+        share_z.default_code = "part_zz"
+        self.assertIn(("part_zz", "Part Z"), partner_model._get_share_type())
+        share_z.product_tmpl_id.display_on_website = False
+        web_products = self.env["product.template"].get_web_share_products(False)
+        self.assertNotIn(share_z.product_tmpl_id, web_products)
+
+    def test_representative_of_member_company(self):
+        partner = self.env["res.partner"].create(
+            {"name": "dummy company partner 1", "is_company": True}
+        )
+        representative = self.env["res.partner"].create(
+            {
+                "name": "dummy representative",
+                "parent_id": partner.id,
+                "representative": True,
+            }
+        )
+        contact = self.env["res.partner"].create(
+            {"name": "dummy contact", "parent_id": partner.id}
+        )
+        self.assertFalse(representative.representative_of_member_company)
+        partner.member = True
+        self.assertTrue(representative.representative_of_member_company)
+        self.assertFalse(contact.representative_of_member_company)
+        representative.active = False
+        self.assertFalse(representative.representative_of_member_company)
+        representative.active = True
+        self.assertTrue(representative.representative_of_member_company)
+        partner.member = False
+        self.assertFalse(representative.representative_of_member_company)
+
+    def test_share_info_is_stored_and_updated(self):
+        partner = self.demo_partner
+        self.assertEqual(partner.number_of_share, 2)
+        self.assertEqual(partner.total_value, 100)
+        self.assertEqual(
+            self.env["res.partner"].search(
+                [("id", "=", partner.id), ("total_value", "=", 100)]
+            ),
+            partner,
+        )
+        share_line = self.env["share.line"].create(
+            {
+                "share_product_id": self.share_y.id,
+                "share_number": 4,
+                "share_unit_price": 25,
+                "partner_id": partner.id,
+                "effective_date": date.today(),
+            }
+        )
+        self.assertEqual(partner.number_of_share, 6)
+        self.assertEqual(partner.total_value, 200)
+        share_line.share_number = 2
+        self.assertEqual(partner.number_of_share, 4)
+        self.assertEqual(partner.total_value, 150)
+        share_line.unlink()
+        self.assertEqual(partner.number_of_share, 2)
+        self.assertEqual(partner.total_value, 100)
+
+    def _count_invoice_total_queries(self, partners):
+        count = self.cr.sql_log_count
+        partners._invoice_total()
+        return self.cr.sql_log_count - count
+
+    def test_invoice_total_query_count(self):
+        partner_model = self.env["res.partner"]
+        companies = partner_model.create(
+            [{"name": "company %d" % i, "is_company": True} for i in range(5)]
+        )
+        partner_model.create(
+            [
+                {"name": "contact %d" % i, "parent_id": company.id}
+                for i, company in enumerate(companies)
+            ]
+        )
+        # warm up the caches (e.g. record rules).
+        companies._invoice_total()
+        single_count = self._count_invoice_total_queries(companies[0])
+        batch_count = self._count_invoice_total_queries(companies)
+        self.assertEqual(single_count, batch_count)
+        self.assertEqual(companies.mapped("total_invoiced"), [0.0] * 5)
+
+    def test_sequence_next_by_id_batch(self):
+        for implementation in ("standard", "no_gap"):
+            sequence = self.env["ir.sequence"].create(
+                {
+                    "name": "dummy sequence",
+                    "implementation": implementation,
+                    "prefix": "OP",
+                    "padding": 3,
+                }
+            )
+            self.assertEqual(sequence.next_by_id_batch(0), [])
+            self.assertEqual(sequence.next_by_id(), "OP001")
+            self.assertEqual(
+                sequence.next_by_id_batch(3), ["OP002", "OP003", "OP004"]
+            )
+            self.assertEqual(sequence.next_by_id(), "OP005")
+
+    def test_allocate_register_numbers(self):
+        self.subscription_request_1.validate_subscription_request()
+        invoice = self.subscription_request_1.capital_release_request
+        partner = invoice.partner_id
+        cooperator_numbers, operation_numbers = invoice._allocate_register_numbers()
+        self.assertEqual(list(cooperator_numbers), [partner.id])
+        self.assertEqual(list(operation_numbers), [invoice.id])
+        invoice.set_cooperator_effective(
+            date.today(),
+            cooperator_number=cooperator_numbers[partner.id],
+            operation_number=operation_numbers[invoice.id],
+        )
+        self.assertEqual(
+            partner.cooperator_register_number, int(cooperator_numbers[partner.id])
+        )
+        register_line = self.env["subscription.register"].search(
+            [("partner_id", "=", partner.id)]
+        )
+        self.assertEqual(register_line.name, operation_numbers[invoice.id])
+
+    def test_process_multiple_paid_capital_release_requests(self):
+        self.company.send_certificate_email = True
+        self.company.create_user = True
+        vals = self.get_dummy_subscription_requests_vals()
+        request_1 = self.env["subscription.request"].create(vals)
+        vals["email"] = "other@example.net"
+        request_2 = self.env["subscription.request"].create(vals)
+        requests = request_1 | request_2
+        requests.validate()
+        invoices = requests.mapped("capital_release_request")
+        invoices._process_paid_capital_release_requests()
+        self.assertEqual(requests.mapped("state"), ["paid", "paid"])
+        for request in requests:
+            partner = request.partner_id
+            self.assertTrue(partner.member)
+            self.assertEqual(partner.share_ids.share_number, request.ordered_parts)
+            register_line = self.env["subscription.register"].search(
+                [("partner_id", "=", partner.id)]
+            )
+            self.assertEqual(register_line.quantity, request.ordered_parts)
+            self.assertEqual(partner.user_ids.login, request.email)
+        self.assertNotEqual(
+            request_1.partner_id.cooperator_register_number,
+            request_2.partner_id.cooperator_register_number,
+        )
+        rows = self.env["cooperator.mail.outbox"].search(
+            [
+                ("res_model", "=", "res.partner"),
+                ("res_id", "in", requests.mapped("partner_id").ids),
+            ]
+        )
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(
+            rows.mapped("template_id"),
+            self.env.ref("cooperator.email_template_certificat"),
+        )
+
+    def test_get_refunded_invoices(self):
+        vals = self.get_dummy_subscription_requests_vals()
+        request_1 = self.env["subscription.request"].create(vals)
+        vals["email"] = "other@example.net"
+        request_2 = self.env["subscription.request"].create(vals)
+        requests = request_1 | request_2
+        requests.validate()
+        invoices = requests.mapped("capital_release_request")
+        request_1.capital_release_request.refund()
+        invoices.mapped("move_name")
+        count = self.cr.sql_log_count
+        refunded = invoices._get_refunded_invoices()
+        # one search for the refunds and one read of their origin.
+        self.assertLessEqual(self.cr.sql_log_count - count, 2)
+        self.assertEqual(refunded, request_1.capital_release_request)
+
+    def test_certificate_cache_invalidation(self):
+        self.demo_partner.member = True
+        report = self.env.ref("cooperator.action_cooperator_report_certificat")
+        name = self.demo_partner.get_certificate_attachment_name()
+        self.assertTrue(name)
+        self.assertEqual(self.demo_partner.get_certificate_attachment_name(), name)
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": name,
+                "datas_fname": name,
+                "datas": b"",
+                "res_model": "res.partner",
+                "res_id": self.demo_partner.id,
+            }
+        )
+        self.assertEqual(report.retrieve_attachment(self.demo_partner), attachment)
+        self.share_line.write({"share_number": 3})
+        self.assertFalse(attachment.exists())
+        self.assertNotEqual(self.demo_partner.get_certificate_attachment_name(), name)
+
+    def test_outdated_certificate_removed(self):
+        self.demo_partner.member = True
+        report = self.env.ref("cooperator.action_cooperator_report_certificat")
+        # a certificate stored before a change of the partner.
+        outdated_name = "cooperator_certificate-outdated.pdf"
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": outdated_name,
+                "datas_fname": outdated_name,
+                "datas": b"",
+                "res_model": "res.partner",
+                "res_id": self.demo_partner.id,
+            }
+        )
+        report.postprocess_pdf_report(self.demo_partner, io.BytesIO(b"%PDF"))
+        self.assertFalse(attachment.exists())
+        self.assertEqual(
+            report.retrieve_attachment(self.demo_partner).name,
+            self.demo_partner.get_certificate_attachment_name(),
+        )
+
+    def test_create_users(self):
+        partner_model = self.env["res.partner"]
+        partner_1 = partner_model.create(
+            {"name": "dummy partner 1", "email": "dummy1@example.net"}
+        )
+        partner_2 = partner_model.create(
+            {"name": "dummy partner 2", "email": "dummy2@example.net"}
+        )
+        archived_user = self.env["res.users"].create(
+            {
+                "name": "dummy user",
+                "login": "dummy2@example.net",
+                "partner_id": partner_2.id,
+                "active": False,
+            }
+        )
+        users = self.env["account.invoice"].create_users(partner_1 | partner_2)
+        self.assertEqual(len(users), 2)
+        self.assertIn(archived_user, users)
+        self.assertTrue(archived_user.active)
+        new_user = users - archived_user
+        self.assertEqual(new_user.partner_id, partner_1)
+        self.assertEqual(new_user.login, "dummy1@example.net")
+        self.assertTrue(new_user.has_group("base.group_portal"))
+        rows = self.env["cooperator.mail.outbox"].search(
+            [("res_model", "=", "res.users")]
+        )
+        self.assertEqual(rows.mapped("res_id"), new_user.ids)
+
+    def test_subscription_register_read_group(self):
+        self.subscription_request_1.validate_subscription_request()
+        self.pay_invoice(self.subscription_request_1.capital_release_request)
+        partner = self.subscription_request_1.partner_id
+        register_line = self.env["subscription.register"].search(
+            [("partner_id", "=", partner.id)]
+        )
+        self.assertEqual(
+            register_line.total_amount_line,
+            register_line.quantity * register_line.share_unit_price,
+        )
+        groups = self.env["subscription.register"].read_group(
+            [("partner_id", "=", partner.id)],
+            ["quantity", "share_unit_price", "total_amount_line"],
+            ["date:month"],
+        )
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(
+            groups[0]["total_amount_line"], register_line.total_amount_line
+        )
+        self.assertNotIn("share_unit_price", groups[0])
+
+    def test_holdings_at_date(self):
+        register_model = self.env["subscription.register"]
+        receiver = self.env["res.partner"].create({"name": "dummy receiver"})
+        vals = {
+            "partner_id": self.demo_partner.id,
+            "share_product_id": self.share_x.id,
+            "share_unit_price": 50,
+        }
+        register_model.create(
+            [
+                dict(
+                    vals,
+                    name="9001",
+                    register_number_operation=9001,
+                    date=date(2020, 1, 1),
+                    type="subscription",
+                    quantity=4,
+                ),
+                dict(
+                    vals,
+                    name="9002",
+                    register_number_operation=9002,
+                    date=date(2020, 6, 1),
+                    type="transfer",
+                    quantity=1,
+                    partner_id_to=receiver.id,
+                ),
+                dict(
+                    vals,
+                    name="9003",
+                    register_number_operation=9003,
+                    date=date(2020, 9, 1),
+                    type="convert",
+                    quantity=2,
+                    share_to_product_id=self.share_y.id,
+                    quantity_to=1,
+                ),
+            ]
+        )
+        partners = self.demo_partner | receiver
+
+        def holdings(day, **kwargs):
+            return {
+                (row["partner_id"], row["share_product_id"]): row["quantity"]
+                for row in register_model.iter_holdings(day, **kwargs)
+                if row["partner_id"] in partners.ids
+            }
+
+        self.assertEqual(holdings(date(2019, 12, 31)), {})
+        self.assertEqual(
+            holdings(date(2020, 1, 1)), {(self.demo_partner.id, self.share_x.id): 4}
+        )
+        self.assertEqual(
+            holdings(date(2020, 6, 1)),
+            {
+                (self.demo_partner.id, self.share_x.id): 3,
+                (receiver.id, self.share_x.id): 1,
+            },
+        )
+        expected = {
+            (self.demo_partner.id, self.share_x.id): 1,
+            (self.demo_partner.id, self.share_y.id): 1,
+            (receiver.id, self.share_x.id): 1,
+        }
+        self.assertEqual(holdings(date(2020, 12, 31)), expected)
+        self.assertEqual(holdings(date(2020, 12, 31), page_size=1), expected)
+        self.assertEqual(
+            holdings(date(2020, 12, 31), share_product_ids=self.share_y.ids),
+            {(self.demo_partner.id, self.share_y.id): 1},
+        )
+        # the line has no share_to_unit_price, as the lines of conversions
+        # recorded before it was stored: the converted amount is kept.
+        amounts = {
+            (row["partner_id"], row["share_product_id"]): row["amount"]
+            for row in register_model.get_holdings(date(2020, 12, 31))
+            if row["partner_id"] == self.demo_partner.id
+        }
+        self.assertEqual(
+            amounts,
+            {
+                (self.demo_partner.id, self.share_x.id): 50,
+                (self.demo_partner.id, self.share_y.id): 100,
+            },
+        )
+
+    def test_capital_report(self):
+        report_model = self.env["cooperator.capital.report"]
+        self.subscription_request_1.validate_subscription_request()
+        self.pay_invoice(self.subscription_request_1.capital_release_request)
+        partner = self.subscription_request_1.partner_id
+        domain = [("partner_id", "=", partner.id)]
+        # the report is only updated when it is refreshed.
+        self.assertFalse(report_model.search(domain))
+        report_model.refresh_materialized_view()
+        groups = report_model.read_group(
+            domain, ["quantity", "amount"], ["share_product_id"]
+        )
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(
+            groups[0]["share_product_id"][0],
+            self.subscription_request_1.share_product_id.id,
+        )
+        self.assertEqual(
+            groups[0]["quantity"], self.subscription_request_1.ordered_parts
+        )
+        self.assertEqual(
+            groups[0]["amount"], self.subscription_request_1.subscription_amount
+        )
+
+    def test_export_register_and_members(self):
+        self.subscription_request_1.validate_subscription_request()
+        self.pay_invoice(self.subscription_request_1.capital_release_request)
+        partner = self.subscription_request_1.partner_id
+        exports = (
+            (self.env["subscription.register"]._get_export_query(), 4),
+            (self.env["res.partner"]._get_member_export_query(), 1),
+        )
+        for (header, query, params), name_index in exports:
+            rows = list(iter_query_rows(self.env.cr, query, params, itersize=1))
+            self.assertIn(partner.name, [row[name_index] for row in rows])
+            self.assertTrue(all(len(row) == len(header) for row in rows))
+            content = b"".join(iter_csv(header, rows)).decode("utf-8")
+            lines = content.splitlines()
+            self.assertEqual(lines[0], ",".join(header))
+            self.assertEqual(len(lines), len(rows) + 1)
+
+    def test_share_line_total_is_stored(self):
+        self.assertEqual(self.share_line.total_amount_line, 100)
+        self.share_line.write({"share_number": 3})
+        self.assertEqual(self.share_line.total_amount_line, 150)
+        self.assertEqual(self.demo_partner.total_value, 150)
+        groups = self.env["share.line"].read_group(
+            [("partner_id", "=", self.demo_partner.id)],
+            ["total_amount_line"],
+            ["partner_id"],
+        )
+        self.assertEqual(groups[0]["total_amount_line"], 150)
+
+    def _create_sell_back_operation(self, quantity):
+        self.demo_partner.member = True
+        new_line = self.env["share.line"].create(
+            {
+                "share_product_id": self.share_x.id,
+                "share_number": 3,
+                "share_unit_price": 50,
+                "partner_id": self.demo_partner.id,
+                "effective_date": datetime.now() - timedelta(days=10),
+            }
+        )
+        operation = self.env["operation.request"].create(
+            {
+                "partner_id": self.demo_partner.id,
+                "operation_type": "sell_back",
+                "share_product_id": self.share_x.id,
+                "quantity": quantity,
+            }
+        )
+        return operation, new_line
+
+    def test_sell_back_last_in_first_out(self):
+        self.company.share_consumption_order = "lifo"
+        operation, new_line = self._create_sell_back_operation(4)
+        operation.approve_operation()
+        operation.execute_operation()
+        self.assertEqual(operation.state, "done")
+        self.assertFalse(new_line.exists())
+        self.assertEqual(self.share_line.share_number, 1)
+        self.assertTrue(self.demo_partner.member)
+
+    def test_sell_back_first_in_first_out(self):
+        self.company.share_consumption_order = "fifo"
+        operation, new_line = self._create_sell_back_operation(4)
+        operation.approve_operation()
+        operation.execute_operation()
+        self.assertFalse(self.share_line.exists())
+        self.assertEqual(new_line.share_number, 1)
+
+    def test_sell_back_all_shares(self):
+        operation, new_line = self._create_sell_back_operation(5)
+        operation.approve_operation()
+        operation.execute_operation()
+        self.assertFalse(self.demo_partner.share_ids)
+        self.assertFalse(self.demo_partner.member)
+        self.assertTrue(self.demo_partner.old_member)
+
+    def test_sell_back_too_many_shares(self):
+        operation, new_line = self._create_sell_back_operation(1)
+        with self.assertRaises(ValidationError):
+            operation._plan_share_consumption(self.demo_partner, self.share_x, 6)
+
+    def test_partial_conversion(self):
+        self.company.unmix_share_type = False
+        self.company.share_consumption_order = "fifo"
+        operation, new_line = self._create_sell_back_operation(1)
+        operation.write(
+            {
+                "operation_type": "convert",
+                "share_to_product_id": self.share_y.id,
+                "quantity": 3,
+            }
+        )
+        oldest_date = self.share_line.effective_date
+        operation.approve_operation()
+        operation.execute_operation()
+        self.assertFalse(self.share_line.exists())
+        self.assertEqual(new_line.share_number, 2)
+        converted_line = self.demo_partner.share_ids.filtered(
+            lambda line: line.share_product_id == self.share_y
+        )
+        self.assertEqual(converted_line.share_number, 6)
+        self.assertEqual(converted_line.share_unit_price, 25)
+        self.assertEqual(converted_line.effective_date, oldest_date)
+        self.assertEqual(self.demo_partner.total_value, 250)
+        register_line = self.env["subscription.register"].search(
+            [("partner_id", "=", self.demo_partner.id), ("type", "=", "convert")]
+        )
+        self.assertEqual(register_line.quantity_to, 6)
+        self.assertEqual(register_line.share_to_unit_price, 25)
+
+    def test_capital_report_conversion(self):
+        self.company.unmix_share_type = False
+        report_model = self.env["cooperator.capital.report"]
+        operation, new_line = self._create_sell_back_operation(1)
+        operation.write(
+            {
+                "operation_type": "convert",
+                "share_to_product_id": self.share_y.id,
+                "quantity": 3,
+            }
+        )
+        operation.approve_operation()
+        operation.execute_operation()
+        register_line = self.env["subscription.register"].search(
+            [("partner_id", "=", self.demo_partner.id), ("type", "=", "convert")]
+        )
+        domain = [("partner_id", "=", self.demo_partner.id), ("type", "=", "convert")]
+
+        def amounts():
+            report_model.refresh_materialized_view()
+            groups = report_model.read_group(
+                domain, ["quantity", "amount"], ["share_product_id"]
+            )
+            return {
+                group["share_product_id"][0]: (group["quantity"], group["amount"])
+                for group in groups
+            }
+
+        # a conversion moves capital between share types without changing
+        # the total.
+        expected = {self.share_x.id: (-3, -150), self.share_y.id: (6, 150)}
+        self.assertEqual(amounts(), expected)
+        # lines of older conversions have no share_to_unit_price.
+        register_line.share_to_unit_price = False
+        self.assertEqual(amounts(), expected)
+
+    def test_execute_operations(self):
+        operation_1, new_line = self._create_sell_back_operation(1)
+        operation_2 = operation_1.copy({"quantity": 2})
+        # more shares than the partner still owns after the first two
+        # operations.
+        operation_3 = operation_1.copy({"quantity": 3})
+        draft_operation = operation_1.copy()
+        operations = operation_1 | operation_2 | operation_3
+        operations.approve_operation()
+        errors = (operations | draft_operation).execute_operations()
+        self.assertEqual(set(errors), {operation_3.id, draft_operation.id})
+        self.assertEqual(operation_1.state, "done")
+        self.assertEqual(operation_2.state, "done")
+        self.assertEqual(operation_3.state, "approved")
+        self.assertEqual(sum(self.demo_partner.share_ids.mapped("share_number")), 2)
+        register_lines = self.env["subscription.register"].search(
+            [("partner_id", "=", self.demo_partner.id), ("type", "=", "sell_back")]
+        )
+        self.assertEqual(len(register_lines), 2)
+        self.assertEqual(len(set(register_lines.mapped("name"))), 2)
+        rows = self.env["cooperator.mail.outbox"].search(
+            [("res_model", "=", "res.partner"), ("res_id", "=", self.demo_partner.id)]
+        )
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(
+            rows.mapped("template_id"),
+            self.env.ref("cooperator.email_template_share_update"),
+        )
+
+    def test_lock_shares(self):
+        partner = self.env.ref("base.res_partner_4")
+        self.assertEqual(partner._lock_shares(), partner)
+        with self.registry.cursor() as other_cr:
+            other_env = self.env(cr=other_cr)
+            other_partner = other_env.ref("base.res_partner_12")
+            other_cr.execute(
+                "select id from res_partner where id = %s for update nowait",
+                (other_partner.id,),
+            )
+            partners = self.env["res.partner"].browse(
+                [partner.id, other_partner.id]
+            )
+            self.assertEqual(partners._lock_shares(skip_locked=True), partner)
+            other_cr.rollback()
+
+    def test_share_totals(self):
+        partner = self.env["res.partner"].create({"name": "dummy partner"})
+        partners = self.demo_partner | partner
+        count = self.cr.sql_log_count
+        totals = self.env["share.line"].get_share_totals(partners)
+        self.assertEqual(self.cr.sql_log_count - count, 1)
+        self.assertEqual(
+            totals, {self.demo_partner.id: {self.share_x.id: 2}, partner.id: {}}
+        )
+
+    def test_validate_operation_query_count(self):
+        operation, new_line = self._create_sell_back_operation(1)
+        # warm up the caches.
+        operation.validate()
+        operation.invalidate_cache()
+        count = self.cr.sql_log_count
+        operation.validate()
+        query_count = self.cr.sql_log_count - count
+        # the number of queries does not depend on the number of share
+        # products.
+        self.env["product.product"].create(
+            [
+                {"name": "share %d" % i, "is_share": True, "list_price": 10}
+                for i in range(5)
+            ]
+        )
+        operation.invalidate_cache()
+        count = self.cr.sql_log_count
+        operation.validate()
+        self.assertEqual(self.cr.sql_log_count - count, query_count)
+
+    def test_execute_due_operations(self):
+        operation, new_line = self._create_sell_back_operation(1)
+        future_operation = operation.copy(
+            {"effective_date": date.today() + timedelta(days=30)}
+        )
+        undated_operation = operation.copy()
+        operation.effective_date = date.today() - timedelta(days=1)
+        operations = operation | future_operation | undated_operation
+        operations.approve_operation()
+        with self.assertRaises(ValidationError):
+            future_operation.execute_operation()
+        self.env["operation.request"].execute_due_operations(chunk_size=1)
+        self.assertEqual(operation.state, "done")
+        self.assertEqual(future_operation.state, "approved")
+        self.assertEqual(undated_operation.state, "approved")
+        future_operation.effective_date = date.today()
+        self.env["operation.request"].execute_due_operations(chunk_size=1)
+        self.assertEqual(future_operation.state, "done")
+        self.assertEqual(undated_operation.state, "approved")
+
+    def test_execute_approved_operations(self):
+        operation, new_line = self._create_sell_back_operation(1)
+        future_operation = operation.copy(
+            {"effective_date": date.today() + timedelta(days=30)}
+        )
+        operations = operation | future_operation
+        operations.approve_operation()
+        self.env["operation.request"].execute_approved_operations(chunk_size=1)
+        self.assertEqual(operation.state, "done")
+        self.assertEqual(future_operation.state, "approved")
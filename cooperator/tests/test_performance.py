@@ -0,0 +1,107 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+import time
+
+from odoo.tests.common import SavepointCase, tagged
+
+_logger = logging.getLogger(__name__)
+
+
+# these tests are not run by default. run them with
+# --test-tags cooperator_performance
+@tagged("-standard", "cooperator_performance")
+class PerformanceCase(SavepointCase):
+    # number of records created by the benchmarks
+    size = 1000
+
+    def _log_duration(self, name, duration):
+        _logger.info(
+            "%s: %d records in %.3fs (%.3fs per thousand records)",
+            name,
+            self.size,
+            duration,
+            duration * 1000 / self.size,
+        )
+
+    def test_compute_representative_of_member_company(self):
+        partner_model = self.env["res.partner"]
+        companies = partner_model.create(
+            [
+                {"name": "company %d" % i, "is_company": True}
+                for i in range(self.size)
+            ]
+        )
+        representatives = partner_model.create(
+            [
+                {
+                    "name": "representative %d" % i,
+                    "parent_id": company.id,
+                    "representative": True,
+                    "type": "representative",
+                }
+                for i, company in enumerate(companies)
+            ]
+        )
+        start = time.perf_counter()
+        companies.write({"member": True})
+        duration = time.perf_counter() - start
+        self._log_duration("representative_of_member_company", duration)
+        self.assertTrue(
+            all(representatives.mapped("representative_of_member_company"))
+        )
+        self.assertLess(duration * 1000 / self.size, 1.0)
+
+    def _create_register_lines(self):
+        partner = self.env["res.partner"].create({"name": "dummy partner"})
+        share_product = self.env["product.product"].create(
+            {
+                "name": "Part X - Founder",
+                "short_name": "Part X",
+                "is_share": True,
+                "default_share_product": True,
+                "force_min_qty": True,
+                "minimum_quantity": 2,
+                "by_individual": True,
+                "by_company": True,
+                "list_price": 50,
+            }
+        )
+        return self.env["subscription.register"].create(
+            [
+                {
+                    "name": str(i),
+                    "register_number_operation": i,
+                    "partner_id": partner.id,
+                    "date": "2020-%02d-01" % (i % 12 + 1),
+                    "quantity": 2,
+                    "share_unit_price": 50,
+                    "share_product_id": share_product.id,
+                    "type": "subscription",
+                }
+                for i in range(self.size)
+            ]
+        )
+
+    def test_subscription_register_pivot(self):
+        register_lines = self._create_register_lines()
+        register_model = self.env["subscription.register"]
+        domain = [("id", "in", register_lines.ids)]
+        for name, groupby in (
+            ("register pivot by month", ["date:month"]),
+            ("register graph by share type", ["share_product_id"]),
+        ):
+            register_model.invalidate_cache()
+            queries_before = self.cr.sql_log_count
+            start = time.perf_counter()
+            groups = register_model.read_group(
+                domain, ["quantity", "total_amount_line"], groupby
+            )
+            duration = time.perf_counter() - start
+            self._log_duration(name, duration)
+            self.assertLessEqual(self.cr.sql_log_count - queries_before, 5)
+            self.assertEqual(
+                sum(group["total_amount_line"] for group in groups),
+                100 * self.size,
+            )
@@ -0,0 +1,14 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import threading
+
+
+def commit_unless_testing(cr):
+    """
+    Commit cr, so that the progress of a long batch is kept if it is
+    interrupted, except when running tests, whose changes are rolled back
+    at the end of each test.
+    """
+    if not getattr(threading.currentThread(), "testing", False):
+        cr.commit()  # pylint: disable=invalid-commit
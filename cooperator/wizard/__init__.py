@@ -2,3 +2,5 @@ from . import create_subscription_from_partner
 from . import validate_subscription_request
 from . import update_share_line
 from . import account_invoice_refund
+from . import import_subscription_request
+from . import subscription_register_holdings
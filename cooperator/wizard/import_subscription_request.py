@@ -0,0 +1,274 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import base64
+import csv
+import io
+import json
+import logging
+import tempfile
+
+import psycopg2
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError, ValidationError
+
+from ..tools import commit_unless_testing
+
+_logger = logging.getLogger(__name__)
+
+_TRUE_VALUES = ("1", "true", "yes", "y", "on")
+# errors that reject a row instead of aborting the import.
+_ROW_ERRORS = (UserError, ValidationError, ValueError, psycopg2.Error)
+
+
+class SubscriptionRequestImport(models.TransientModel):
+    """
+    Import subscription requests from a csv or a json lines file.
+
+    The file is read row by row and the requests are created by chunks.
+    Each chunk is committed, so memory usage does not depend on the size of
+    the file. Rows that do not pass the same checks as the website form are
+    written in a rejected rows report instead of being imported.
+
+    The import can also be run without the wizard, e.g. from odoo shell:
+
+        with open(path, "rb") as file_obj:
+            env["subscription.request.import"].import_file(file_obj, "csv")
+    """
+
+    _name = "subscription.request.import"
+    _description = "Import subscription requests"
+
+    data_file = fields.Binary(string="File", required=True, attachment=True)
+    filename = fields.Char(string="Filename")
+    file_format = fields.Selection(
+        [("csv", "CSV"), ("jsonl", "JSON lines")],
+        string="Format",
+        required=True,
+        default="csv",
+        help="CSV: one row per request, with a header line containing"
+        " subscription request field names. JSON lines: one json object per"
+        " line, with subscription request field names as keys.",
+    )
+    chunk_size = fields.Integer(string="Chunk size", required=True, default=1000)
+    send_confirmation_email = fields.Boolean(
+        string="Send confirmation emails",
+        help="Send the confirmation email to each imported subscriber. Leave"
+        " unchecked when importing existing members, e.g. during a migration.",
+    )
+    state = fields.Selection(
+        [("draft", "Draft"), ("done", "Done")], required=True, default="draft"
+    )
+    imported_count = fields.Integer(string="Imported requests", readonly=True)
+    rejected_count = fields.Integer(string="Rejected rows", readonly=True)
+    rejected_file = fields.Binary(string="Rejected rows report", readonly=True)
+    rejected_filename = fields.Char(readonly=True)
+
+    def _iter_csv_rows(self, file_obj):
+        reader = csv.DictReader(io.TextIOWrapper(file_obj, encoding="utf-8-sig"))
+        for row in reader:
+            yield reader.line_num, row
+
+    def _iter_jsonl_rows(self, file_obj):
+        for line_num, line in enumerate(
+            io.TextIOWrapper(file_obj, encoding="utf-8-sig"), start=1
+        ):
+            if line.strip():
+                yield line_num, json.loads(line)
+
+    def _get_reference_maps(self):
+        """
+        Return dicts used to convert many2one values given as codes to ids,
+        so that no search is done per row.
+        """
+        products = self.env["product.product"].search([("is_share", "=", True)])
+        countries = self.env["res.country"].search([])
+        return {
+            "share_product_id": {
+                product.default_code: product.id
+                for product in products
+                if product.default_code
+            },
+            "country_id": {country.code: country.id for country in countries},
+            "activities_country_id": {
+                country.code: country.id for country in countries
+            },
+        }
+
+    def _convert_row(self, row, reference_maps):
+        """Convert a row of the file to subscription request values."""
+        request_model = self.env["subscription.request"]
+        vals = {}
+        for field_name, value in row.items():
+            field = request_model._fields.get(field_name)
+            if field is None:
+                continue
+            if isinstance(value, str):
+                value = value.strip()
+            if value in ("", None):
+                continue
+            if field.type == "boolean" and isinstance(value, str):
+                value = value.lower() in _TRUE_VALUES
+            elif field.type == "integer":
+                value = int(value)
+            elif field.type == "many2one":
+                references = reference_maps.get(field_name, {})
+                if value in references:
+                    value = references[value]
+                else:
+                    value = int(value)
+            vals[field_name] = value
+        return vals
+
+    def _check_vals(self, vals, required_fields):
+        """
+        Check the values like the website form does. Return an error
+        message, or None if the values are valid.
+        """
+        request_model = self.env["subscription.request"]
+        missing = [field for field in required_fields if not vals.get(field)]
+        if missing:
+            return _("Missing mandatory fields: %s") % ", ".join(missing)
+        if (
+            "iban" in required_fields
+            and not vals.get("skip_iban_control")
+            and not request_model.check_iban(vals["iban"])
+        ):
+            return _("Provided IBAN is not valid.")
+        return None
+
+    def _create_chunk(self, chunk, reject):
+        """
+        Create the subscription requests of a chunk of (line_num, row, vals)
+        tuples. If the chunk cannot be created at once, create the requests
+        one by one to reject only the faulty rows.
+        """
+        request_model = self.env["subscription.request"]
+        try:
+            with self.env.cr.savepoint():
+                return len(request_model.create([vals for _l, _r, vals in chunk]))
+        except _ROW_ERRORS:
+            self.invalidate_cache()
+            created = 0
+            for line_num, row, vals in chunk:
+                try:
+                    with self.env.cr.savepoint():
+                        request_model.create(vals)
+                    created += 1
+                except _ROW_ERRORS as error:
+                    self.invalidate_cache()
+                    reject(line_num, row, getattr(error, "name", str(error)))
+            return created
+
+    @api.model
+    def import_file(
+        self,
+        file_obj,
+        file_format="csv",
+        chunk_size=1000,
+        report=None,
+        send_confirmation_email=False,
+    ):
+        """
+        Import the subscription requests of the binary file object file_obj.
+
+        Rejected rows are written as csv to the text file object report, if
+        given. The confirmation emails are only sent with
+        send_confirmation_email. Return a tuple (imported count, rejected
+        count).
+        """
+        if not send_confirmation_email:
+            self = self.with_context(cooperator_skip_confirmation_mail=True)
+        if file_format == "jsonl":
+            rows = self._iter_jsonl_rows(file_obj)
+        else:
+            rows = self._iter_csv_rows(file_obj)
+        required_fields = self.env["subscription.request"].get_required_field()
+        reference_maps = self._get_reference_maps()
+        report_writer = csv.writer(report) if report is not None else None
+        if report_writer:
+            report_writer.writerow(["line", "error", "row"])
+        counts = {"imported": 0, "rejected": 0}
+
+        def reject(line_num, row, error):
+            counts["rejected"] += 1
+            if report_writer:
+                report_writer.writerow([line_num, error, json.dumps(row)])
+
+        chunk = []
+        for line_num, row in rows:
+            try:
+                vals = self._convert_row(row, reference_maps)
+            except (ValueError, TypeError) as error:
+                reject(line_num, row, str(error))
+                continue
+            error = self._check_vals(vals, required_fields)
+            if error:
+                reject(line_num, row, error)
+                continue
+            chunk.append((line_num, row, vals))
+            if len(chunk) >= chunk_size:
+                counts["imported"] += self._create_chunk(chunk, reject)
+                commit_unless_testing(self.env.cr)
+                _logger.info(
+                    "imported %d subscription requests", counts["imported"]
+                )
+                chunk = []
+        if chunk:
+            counts["imported"] += self._create_chunk(chunk, reject)
+            commit_unless_testing(self.env.cr)
+        return counts["imported"], counts["rejected"]
+
+    def _open_data_file(self):
+        attachment = (
+            self.env["ir.attachment"]
+            .sudo()
+            .search(
+                [
+                    ("res_model", "=", self._name),
+                    ("res_field", "=", "data_file"),
+                    ("res_id", "=", self.id),
+                ],
+                limit=1,
+            )
+        )
+        if attachment.store_fname:
+            # read the file from the filestore instead of loading it in
+            # memory.
+            return open(attachment._full_path(attachment.store_fname), "rb")
+        return io.BytesIO(base64.b64decode(self.data_file))
+
+    @api.multi
+    def action_import(self):
+        self.ensure_one()
+        with self._open_data_file() as file_obj, tempfile.TemporaryFile(
+            mode="w+", encoding="utf-8", newline=""
+        ) as report:
+            imported, rejected = self.import_file(
+                file_obj,
+                self.file_format,
+                self.chunk_size,
+                report,
+                send_confirmation_email=self.send_confirmation_email,
+            )
+            vals = {
+                "state": "done",
+                "imported_count": imported,
+                "rejected_count": rejected,
+            }
+            if rejected:
+                report.seek(0)
+                vals["rejected_file"] = base64.b64encode(
+                    report.read().encode("utf-8")
+                )
+                vals["rejected_filename"] = "rejected_subscription_requests.csv"
+        self.write(vals)
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "view_type": "form",
+            "target": "new",
+        }
@@ -0,0 +1,105 @@
+# Copyright 2026 Coop IT Easy SC
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import base64
+import csv
+import tempfile
+
+from odoo import api, fields, models
+
+
+class SubscriptionRegisterHoldings(models.TransientModel):
+    """
+    Export the shares held by each cooperator on a date, computed from the
+    subscription register.
+    """
+
+    _name = "subscription.register.holdings"
+    _description = "Holdings at date"
+
+    date = fields.Date(
+        string="Date", required=True, default=lambda self: fields.Date.today()
+    )
+    share_product_ids = fields.Many2many(
+        "product.product",
+        string="Share types",
+        domain=[("is_share", "=", True)],
+        help="Leave empty to export all share types.",
+    )
+    state = fields.Selection(
+        [("draft", "Draft"), ("done", "Done")], required=True, default="draft"
+    )
+    holdings_count = fields.Integer(string="Holdings", readonly=True)
+    holdings_file = fields.Binary(string="Holdings file", readonly=True)
+    holdings_filename = fields.Char(readonly=True)
+
+    def _write_holdings(self, report):
+        """Write the holdings as csv to the text file object report."""
+        register_model = self.env["subscription.register"]
+        writer = csv.writer(report)
+        writer.writerow(
+            [
+                "cooperator_register_number",
+                "partner",
+                "share_type",
+                "quantity",
+                "amount",
+            ]
+        )
+        count = 0
+        page = []
+        rows = register_model.iter_holdings(
+            self.date, share_product_ids=self.share_product_ids.ids
+        )
+        for row in rows:
+            page.append(row)
+            if len(page) >= 1000:
+                count += self._write_holdings_page(writer, page)
+                page = []
+        count += self._write_holdings_page(writer, page)
+        return count
+
+    def _write_holdings_page(self, writer, page):
+        # browse the partners of a page at once, and forget them afterwards
+        # to keep the memory usage bounded.
+        partner_model = self.env["res.partner"]
+        partners = partner_model.browse([row["partner_id"] for row in page])
+        products = self.env["product.product"].browse(
+            [row["share_product_id"] for row in page]
+        )
+        for row, partner, product in zip(page, partners, products):
+            writer.writerow(
+                [
+                    partner.cooperator_register_number,
+                    partner.name,
+                    product.short_name or product.name,
+                    row["quantity"],
+                    row["amount"],
+                ]
+            )
+        partner_model.invalidate_cache()
+        return len(page)
+
+    @api.multi
+    def action_export(self):
+        self.ensure_one()
+        with tempfile.TemporaryFile(mode="w+", encoding="utf-8", newline="") as report:
+            count = self._write_holdings(report)
+            report.seek(0)
+            self.write(
+                {
+                    "state": "done",
+                    "holdings_count": count,
+                    "holdings_file": base64.b64encode(report.read().encode("utf-8")),
+                    "holdings_filename": "holdings_%s.csv"
+                    % fields.Date.to_string(self.date),
+                }
+            )
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "view_type": "form",
+            "target": "new",
+        }
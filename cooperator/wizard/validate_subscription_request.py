@@ -1,4 +1,4 @@
-from odoo import api, models
+from odoo import _, api, models
 
 
 # no need for a wizard here, a server action would do the trick
@@ -15,6 +15,15 @@ class ValidateSubscriptionRequest(models.TransientModel):
             lambda record: record.state in ["draft", "waiting"]
         )
 
-        for subscription_request in subscription_requests:
-            subscription_request.validate_subscription_request()
+        errors = subscription_requests.validate()
+        if errors:
+            return {
+                "type": "ir.actions.act_window",
+                "name": _("Subscription requests not validated"),
+                "res_model": "subscription.request",
+                "view_mode": "tree,form",
+                "view_type": "form",
+                "domain": [("id", "in", list(errors))],
+                "target": "current",
+            }
         return True
@@ -349,7 +349,15 @@ class WebsiteSubscription(http.Controller):
                 max_amount = max_amount - partner.total_value
                 if company.unmix_share_type:
                     share = self.get_selected_share(kwargs)
-                    if partner.cooperator_type != share.default_code:
+                    share_line_model = request.env["share.line"].sudo()
+                    share_totals = share_line_model.get_share_totals(partner)
+                    if any(
+                        share_number > 0
+                        for share_product_id, share_number in share_totals[
+                            partner.id
+                        ].items()
+                        if share_product_id != share.id
+                    ):
                         values = self.fill_values(values, is_company, logged)
                         values["error_msg"] = _(
                             "You can't subscribe to two different types of share."
@@ -1,4 +1,5 @@
 import base64
+from itertools import accumulate
 
 from odoo import api, fields, models
 
@@ -103,32 +104,116 @@ class TaxShelterDeclaration(models.Model):
         "as non eligible",
     )
 
-    def _excluded_from_declaration(self, entry):
-        if entry.date >= self.date_from and entry.date <= self.date_to:
-            declaration = self
-        else:
-            declaration = self.search(
-                [
-                    ("date_from", "<=", entry.date),
-                    ("date_to", ">=", entry.date),
-                ]
-            )
-        if entry.partner_id.id in declaration.excluded_cooperator.ids:
-            return True
-        return False
+    def _get_exclusions(self):
+        """
+        Return the excluded cooperators of this declaration as a set of
+        partner ids, and the ones of the other declarations as a list of
+        (date_from, date_to, set of partner ids) tuples.
+        """
+        others = self.search([("id", "!=", self.id)])
+        return (
+            set(self.excluded_cooperator.ids),
+            [
+                (
+                    declaration.date_from,
+                    declaration.date_to,
+                    set(declaration.excluded_cooperator.ids),
+                )
+                for declaration in others
+                if declaration.excluded_cooperator
+            ],
+        )
+
+    def _excluded_from_declaration(self, entry, exclusions=None):
+        """
+        Return whether the entry (a row of _read_entries()) is excluded by
+        the declaration covering its date. exclusions are the ones returned
+        by _get_exclusions(), they are read if not given.
+        """
+        entry = self._get_entry_dict(entry)
+        if exclusions is None:
+            exclusions = self._get_exclusions()
+        excluded_ids, other_exclusions = exclusions
+        if self.date_from <= entry["date"] <= self.date_to:
+            return entry["partner_id"] in excluded_ids
+        return any(
+            date_from <= entry["date"] <= date_to
+            and entry["partner_id"] in partner_ids
+            for date_from, date_to, partner_ids in other_exclusions
+        )
+
+    def _read_entries(self):
+        """
+        Return the subscription register entries of active individuals
+        until the end of the declaration, in order of operation, as dicts
+        read with one query.
+        """
+        self.env.cr.execute(
+            """
+            select r.id,
+                r.partner_id,
+                coalesce(p.cooperator_register_number, 0)
+                    as cooperator_register_number,
+                r.share_product_id,
+                t.short_name as share_short_name,
+                coalesce(r.share_unit_price, 0)::float as share_unit_price,
+                r.quantity,
+                r.date,
+                r.type,
+                coalesce(r.total_amount_line, 0)::float as total_amount_line
+            from subscription_register r
+            join res_partner p on p.id = r.partner_id
+            join product_product pp on pp.id = r.share_product_id
+            join product_template t on t.id = pp.product_tmpl_id
+            where not coalesce(p.is_company, false)
+                and p.active
+                and r.date <= %s
+                and r.type in ('subscription', 'sell_back', 'transfer')
+            order by r.register_number_operation, r.id
+            """,
+            (self.date_to,),
+        )
+        return self.env.cr.dictfetchall()
+
+    def _get_entry_dict(self, entry):
+        """
+        Return entry as a dict like the rows of _read_entries(). entry can
+        also be a subscription.register record, as it was before the
+        entries were read with sql.
+        """
+        if not isinstance(entry, models.BaseModel):
+            return entry
+        return {
+            "id": entry.id,
+            "partner_id": entry.partner_id.id,
+            "cooperator_register_number": (
+                entry.partner_id.cooperator_register_number or 0
+            ),
+            "share_product_id": entry.share_product_id.id,
+            "share_short_name": entry.share_short_name,
+            "share_unit_price": entry.share_unit_price,
+            "quantity": entry.quantity,
+            "date": entry.date,
+            "type": entry.type,
+            "total_amount_line": entry.total_amount_line,
+        }
 
     def _prepare_line(self, certificate, entry, ongoing_capital_sub, excluded):
+        # certificate can be a record or an id, entry a record or a dict.
+        if isinstance(certificate, models.BaseModel):
+            certificate = certificate.id
+        entry = self._get_entry_dict(entry)
         line_vals = {}
-        line_vals["tax_shelter_certificate"] = certificate.id
-        line_vals["share_type"] = entry.share_product_id.id
-        line_vals["share_short_name"] = entry.share_short_name
-        line_vals["share_unit_price"] = entry.share_unit_price
-        line_vals["quantity"] = entry.quantity
-        line_vals["transaction_date"] = entry.date
-        line_vals["type"] = TYPE_MAP[entry.type]
-        if entry.type == "subscription":
+        line_vals["tax_shelter_certificate"] = certificate
+        line_vals["share_type"] = entry["share_product_id"]
+        line_vals["share_short_name"] = entry["share_short_name"]
+        line_vals["share_unit_price"] = entry["share_unit_price"]
+        line_vals["quantity"] = entry["quantity"]
+        line_vals["transaction_date"] = entry["date"]
+        line_vals["type"] = TYPE_MAP[entry["type"]]
+        if entry["type"] == "subscription":
             if not excluded:
-                capital_after_sub = ongoing_capital_sub + entry.total_amount_line
+                capital_after_sub = ongoing_capital_sub + entry["total_amount_line"]
             else:
                 capital_after_sub = ongoing_capital_sub
             line_vals["capital_before_sub"] = ongoing_capital_sub
@@ -138,55 +223,77 @@ class TaxShelterDeclaration(models.Model):
                 line_vals["tax_shelter"] = True
         return line_vals
 
-    def _compute_certificates(self, entries, partner_certificate):
-        ongoing_capital_sub = 0.0
+    def _compute_certificates(self, entries, partner_certificate=None):
+        """
+        Create the certificates and their lines for the entries, with one
+        create() for the certificates and one for the lines.
+
+        partner_certificate can map partner ids to existing certificates, to
+        which the lines of these partners are added. Return it, completed
+        with the created certificates.
+        """
+        entries = [self._get_entry_dict(entry) for entry in entries]
+        if partner_certificate is None:
+            partner_certificate = {}
+        exclusions = self._get_exclusions()
+        excluded = [
+            self._excluded_from_declaration(entry, exclusions) for entry in entries
+        ]
+        # capital subscribed before each entry: the cumulative sum of the
+        # amounts of the previous eligible subscriptions.
+        contributions = [
+            entry["total_amount_line"]
+            if entry["type"] == "subscription" and not is_excluded
+            else 0.0
+            for entry, is_excluded in zip(entries, excluded)
+        ]
+        capital_before = [0.0] + list(accumulate(contributions))[:-1]
+
+        # one certificate per cooperator, in order of first entry.
+        cert_vals_by_partner = {}
         for entry in entries:
-            certificate = partner_certificate.get(entry.partner_id.id, False)
-
-            if not certificate:
-                # create a certificate for this cooperator
-                cert_vals = {}
-                cert_vals["declaration_id"] = self.id
-                cert_vals["partner_id"] = entry.partner_id.id
-                cert_vals[
-                    "cooperator_number"
-                ] = entry.partner_id.cooperator_register_number
-                certificate = self.env["tax.shelter.certificate"].create(cert_vals)
-                partner_certificate[entry.partner_id.id] = certificate
-            excluded = self._excluded_from_declaration(entry)
-            line_vals = self._prepare_line(
-                certificate, entry, ongoing_capital_sub, excluded
+            if entry["partner_id"] in partner_certificate:
+                continue
+            cert_vals_by_partner.setdefault(
+                entry["partner_id"],
+                {
+                    "declaration_id": self.id,
+                    "partner_id": entry["partner_id"],
+                    "cooperator_number": entry["cooperator_register_number"],
+                },
             )
-            certificate.write({"lines": [(0, 0, line_vals)]})
-
-            if entry.type == "subscription" and not excluded:
-                ongoing_capital_sub += entry.total_amount_line
+        certificates = self.env["tax.shelter.certificate"].create(
+            list(cert_vals_by_partner.values())
+        )
+        partner_certificate.update(zip(cert_vals_by_partner, certificates))
 
+        self.env["certificate.line"].create(
+            [
+                self._prepare_line(
+                    partner_certificate[entry["partner_id"]].id,
+                    entry,
+                    ongoing_capital_sub,
+                    is_excluded,
+                )
+                for entry, ongoing_capital_sub, is_excluded in zip(
+                    entries, capital_before, excluded
+                )
+            ]
+        )
         return partner_certificate
 
     @api.multi
     def compute_declaration(self):
         self.ensure_one()
-        entries = self.env["subscription.register"].search(
-            [
-                ("partner_id.is_company", "=", False),
-                ("date", "<=", self.date_to),
-                ("type", "in", ["subscription", "sell_back", "transfer"]),
-            ]
-        )
-
-        subscriptions = entries.filtered(
-            lambda r: r.type == "subscription" and r.date < self.date_from
-        )  # noqa
-        cap_prev_sub = 0.0
-        for subscription in subscriptions:
-            cap_prev_sub += subscription.total_amount_line
+        entries = self._read_entries()
 
-        self.previously_subscribed_capital = cap_prev_sub
-
-        partner_cert = {}
+        self.previously_subscribed_capital = sum(
+            entry["total_amount_line"]
+            for entry in entries
+            if entry["type"] == "subscription" and entry["date"] < self.date_from
+        )
 
-        partner_cert = self._compute_certificates(entries, partner_cert)
+        self._compute_certificates(entries)
 
         self.state = "computed"
 
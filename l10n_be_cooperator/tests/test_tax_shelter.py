@@ -13,8 +13,10 @@ class TestTaxShelter(SavepointCase, CooperatorTestMixin):
         super().setUpClass()
         cls.set_up_cooperator_test_data()
 
-    def _create_dummy_cooperator_2021(self):
+    def _create_dummy_cooperator_2021(self, email=None):
         vals = self.get_dummy_subscription_requests_vals()
+        if email:
+            vals["email"] = email
         vals["date"] = date(2021, 6, 21)
         subscription_request = self.env["subscription.request"].create(vals)
         subscription_request.validate_subscription_request()
@@ -24,7 +26,7 @@ class TestTaxShelter(SavepointCase, CooperatorTestMixin):
         )
         return subscription_request.partner_id
 
-    def _create_tax_shelter_declaration_2022(self):
+    def _create_tax_shelter_declaration_2022(self, excluded_cooperators=None):
         declaration = self.env["tax.shelter.declaration"].create(
             {
                 "name": "2022",
@@ -35,6 +37,9 @@ class TestTaxShelter(SavepointCase, CooperatorTestMixin):
                 "month_to": "décembre",
                 "tax_shelter_percentage": "45",
                 "tax_shelter_capital_limit": 250000,
+                "excluded_cooperator": [(6, 0, excluded_cooperators.ids)]
+                if excluded_cooperators
+                else False,
             }
         )
         declaration.compute_declaration()
@@ -51,6 +56,40 @@ class TestTaxShelter(SavepointCase, CooperatorTestMixin):
         self.assertEqual(certificate.state, "validated")
         self.assertEqual(certificate.total_amount, 50)
 
+    def test_tax_shelter_archived_cooperator(self):
+        cooperator_1 = self._create_dummy_cooperator_2021()
+        cooperator_2 = self._create_dummy_cooperator_2021("dummy2@example.net")
+        cooperator_1.active = False
+        declaration = self._create_tax_shelter_declaration_2022()
+        certificates = declaration.tax_shelter_certificates
+        self.assertEqual(certificates.mapped("partner_id"), cooperator_2)
+        self.assertEqual(certificates.lines.capital_before_sub, 0)
+
+    def test_tax_shelter_capital_and_exclusions(self):
+        cooperator_1 = self._create_dummy_cooperator_2021()
+        cooperator_2 = self._create_dummy_cooperator_2021("dummy2@example.net")
+        cooperator_3 = self._create_dummy_cooperator_2021("dummy3@example.net")
+        declaration = self._create_tax_shelter_declaration_2022(
+            excluded_cooperators=cooperator_2
+        )
+        self.assertEqual(declaration.previously_subscribed_capital, 0)
+        lines = declaration.tax_shelter_certificates.mapped("lines")
+        line_1, line_2, line_3 = (
+            lines.filtered(
+                lambda line: line.tax_shelter_certificate.partner_id == cooperator
+            )
+            for cooperator in (cooperator_1, cooperator_2, cooperator_3)
+        )
+        self.assertTrue(line_1.tax_shelter)
+        self.assertEqual(line_1.capital_before_sub, 0)
+        self.assertFalse(line_2.tax_shelter)
+        self.assertEqual(line_2.capital_before_sub, 50)
+        self.assertEqual(line_2.capital_after_sub, 50)
+        # the subscription of the excluded cooperator is not counted.
+        self.assertTrue(line_3.tax_shelter)
+        self.assertEqual(line_3.capital_before_sub, 50)
+        self.assertEqual(line_3.capital_after_sub, 100)
+
     def test_tax_shelter_certificates_mail(self):
         cooperator = self._create_dummy_cooperator_2021()
         declaration = self._create_tax_shelter_declaration_2022()
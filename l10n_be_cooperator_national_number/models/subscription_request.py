@@ -28,15 +28,14 @@ class SubscriptionRequest(models.Model):
         )
         return national_number.name
 
-    def validate_subscription_request(self):
-        self.ensure_one()
+    def _check_validation(self):
+        super()._check_validation()
         if (
             self._check_national_number_required()
             and not self.national_number
             and not self.is_company
         ):
             raise UserError(_("National Number is required."))
-        super().validate_subscription_request()
 
     def create_national_number(self, partner):
         if self._check_national_number_required():
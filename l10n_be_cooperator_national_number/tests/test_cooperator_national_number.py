@@ -40,3 +40,10 @@ class TestCooperatorNationalNumber(SavepointCase, CooperatorTestMixin):
         subscription_request = self.create_subscription_request()
         with self.assertRaises(UserError):
             subscription_request.validate_subscription_request()
+
+    def test_error_if_missing_and_required_in_batch(self):
+        self.set_national_number_required()
+        subscription_request = self.create_subscription_request()
+        errors = subscription_request.validate()
+        self.assertEqual(list(errors), [subscription_request.id])
+        self.assertEqual(subscription_request.state, "draft")
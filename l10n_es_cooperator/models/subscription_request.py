@@ -1,5 +1,7 @@
 from odoo import fields, models
 
+from odoo.addons.cooperator.models.partner import normalize_identifier
+
 
 class SubscriptionRequest(models.Model):
     _inherit = "subscription.request"
@@ -24,7 +26,8 @@ class SubscriptionRequest(models.Model):
         return req_fields
 
     def _get_partner_domain(self):
-        if self.vat:
-            return [("vat", "=", self.vat)]
+        vat_key = normalize_identifier(self.vat)
+        if vat_key:
+            return [("vat_key", "=", vat_key)]
         else:
             return None